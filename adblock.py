@@ -0,0 +1,798 @@
+import bisect
+import hashlib
+import marshal
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from public_suffix import registrable_domain
+
+# Resource types understood by the "$script", "$image", ... filter options
+RESOURCE_TYPES = {
+    "document": 1 << 0,
+    "subdocument": 1 << 1,
+    "stylesheet": 1 << 2,
+    "script": 1 << 3,
+    "image": 1 << 4,
+    "font": 1 << 5,
+    "object": 1 << 6,
+    "media": 1 << 7,
+    "xmlhttprequest": 1 << 8,
+    "ping": 1 << 9,
+    "websocket": 1 << 10,
+    "other": 1 << 11,
+}
+ALL_TYPES = (1 << 12) - 1
+# Rules without a type option never apply to top-level documents
+DEFAULT_TYPES = ALL_TYPES & ~RESOURCE_TYPES["document"]
+
+TYPE_ALIASES = {
+    "xhr": "xmlhttprequest",
+    "frame": "subdocument",
+    "css": "stylesheet",
+    "object-subrequest": "object",
+    "doc": "document",
+    "3p": "third-party",
+    "1p": "first-party",
+}
+
+# Options that do not change whether a request is blocked
+IGNORED_OPTIONS = {"important", "collapse", "~collapse"}
+# Request types the interceptor cannot recognise; a rule limited to them is
+# dropped rather than applied to every request
+UNSUPPORTED_TYPES = {"popup"}
+
+FILTER_LIST_DIR = "filters"
+
+# Compiled rules are cached next to browser.db; bump the version whenever
+# the layout or the meaning of a serialized rule changes
+CACHE_FILE = "adblock.cache"
+CACHE_MAGIC = b"ABRC"
+CACHE_VERSION = 2
+# magic, version, little-endian flag, stat digest, content digest,
+# host hash count, directory offset, directory length
+_CACHE_HEADER = struct.Struct("<4sII16s32sQQQ")
+
+# Host-level verdicts kept in the per-snapshot LRU
+HOST_NONE, HOST_BLOCK, HOST_ALLOW = 0, 1, 2
+VERDICT_CACHE_SIZE = 4096
+
+DEFAULT_FILTERS = [
+    "||doubleclick.net^",
+    "||google-analytics.com^",
+    "||googlesyndication.com^",
+    "||googleadservices.com^",
+    "||adservice.google.com^",
+    "||ads.",
+    "||analytics.",
+    "||tracker.",
+    "||advertising.",
+]
+
+# Names that show up in hosts files but are not blocklist entries
+HOSTS_FILE_IGNORED = {
+    "localhost", "localhost.localdomain", "local", "broadcasthost",
+    "ip6-localhost", "ip6-loopback", "ip6-localnet", "ip6-mcastprefix",
+    "ip6-allnodes", "ip6-allrouters", "ip6-allhosts", "0.0.0.0",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9%]{2,}")
+_HOST_RULE_RE = re.compile(r"^\|\|([a-z0-9.-]+)\^\|?$")
+_SEPARATOR = r"(?:[^\w.%-]|$)"
+_DOMAIN_ANCHOR = r"^[a-z][a-z0-9.+-]*:(?://)?(?:[^/?#]*\.)?"
+
+
+def host_suffixes(host):
+    """Yield host and each of its parent domains: a.b.com, b.com, com"""
+    while host:
+        yield host
+        dot = host.find(".")
+        if dot < 0:
+            return
+        host = host[dot + 1:]
+
+
+def base_domain(host):
+    """Registrable domain (eTLD+1) according to the Public Suffix List"""
+    return registrable_domain(host)
+
+
+def is_third_party(host, first_party_host):
+    if not first_party_host:
+        return False
+    return base_domain(host) != base_domain(first_party_host)
+
+
+def domain_hash(domain):
+    """Stable 64-bit hash of a domain name"""
+    digest = hashlib.blake2b(domain.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def parse_hosts_line(line):
+    """Domains listed on one hosts-file line (``0.0.0.0 a.com`` or ``a.com``)"""
+    line = line.split("#", 1)[0].strip().lower()
+    if not line:
+        return []
+    fields = line.split()
+    if len(fields) > 1:
+        fields = fields[1:]  # drop the sink address
+    return [d.rstrip(".") for d in fields if d not in HOSTS_FILE_IGNORED]
+
+
+class HostBlocklist:
+    """Compact set of blocked domains for multi-million entry hosts files
+
+    Domains are stored as a sorted array of 64-bit hashes, with a table of
+    offsets keyed by the top 16 hash bits narrowing each binary search to a
+    few dozen entries. A Python set of the same domains costs ~10x more.
+
+    Measured on CPython 3.11 (x86-64), random 8-20 character domains read
+    from a hosts file; "peak build" is the RSS growth while loading it:
+
+        entries   store size   set of str   peak build   build    probe    a.b.c.com
+        1M          8.3 MB       100 MB        16 MB     3.1 s    2.7 us     ~9 us
+        3M         24.3 MB       334 MB        46 MB    12.2 s    2.3 us     ~6 us
+
+    The build holds the hashes in two arrays at most (see from_hashes).
+
+    A probe is one blake2b hash plus a bisect bounded to one bucket, so it
+    stays flat as the list grows; matching a host probes each parent domain.
+    Hash collisions (~n / 2**64 per probe) are the only false positives.
+    A Bloom filter in front was measured and did not beat the bucketed
+    search in pure Python, so there is none.
+    """
+
+    BUCKET_BITS = 16
+
+    def __init__(self, hashes=None, offsets=None):
+        self.hashes = hashes if hashes is not None else array("Q")
+        self.offsets = offsets if offsets is not None else self.build_offsets(self.hashes)
+
+    @classmethod
+    def from_domains(cls, domains):
+        hashes = array("Q")
+        for domain in domains:
+            if domain:
+                hashes.append(domain_hash(domain))
+        return cls.from_hashes(hashes)
+
+    @classmethod
+    def from_hashes(cls, hashes):
+        """Sort and deduplicate an array of hashes into a HostBlocklist
+
+        A counting sort on the bucket bits places the hashes into a second
+        array, then each bucket (a few dozen entries) is sorted and
+        deduplicated in place, so no more than two arrays' worth of memory
+        is ever held; a set or a sorted list would box every hash.
+        """
+        shift = 64 - cls.BUCKET_BITS
+        starts = array("I", [0]) * ((1 << cls.BUCKET_BITS) + 1)
+        for value in hashes:
+            starts[(value >> shift) + 1] += 1
+        for bucket in range(1 << cls.BUCKET_BITS):
+            starts[bucket + 1] += starts[bucket]
+
+        ordered = array("Q", bytes(8 * len(hashes)))
+        fill = array("I", starts)
+        for value in hashes:
+            bucket = value >> shift
+            ordered[fill[bucket]] = value
+            fill[bucket] += 1
+        del fill
+
+        offsets = array("I", [0]) * ((1 << cls.BUCKET_BITS) + 1)
+        end = 0
+        for bucket in range(1 << cls.BUCKET_BITS):
+            offsets[bucket] = end
+            previous = None
+            for value in sorted(ordered[starts[bucket]:starts[bucket + 1]]):
+                if value != previous:
+                    ordered[end] = value
+                    end += 1
+                    previous = value
+        offsets[-1] = end
+        del ordered[end:]
+        return cls(ordered, offsets)
+
+    @classmethod
+    def build_offsets(cls, hashes):
+        shift = 64 - cls.BUCKET_BITS
+        offsets = array("I", [0]) * ((1 << cls.BUCKET_BITS) + 1)
+        for bucket in range(1 << cls.BUCKET_BITS):
+            offsets[bucket] = bisect.bisect_left(hashes, bucket << shift)
+        offsets[-1] = len(hashes)
+        return offsets
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def contains_hash(self, value):
+        bucket = value >> (64 - self.BUCKET_BITS)
+        lo, hi = self.offsets[bucket], self.offsets[bucket + 1]
+        i = bisect.bisect_left(self.hashes, value, lo, hi)
+        return i < hi and self.hashes[i] == value
+
+    def __contains__(self, domain):
+        return self.contains_hash(domain_hash(domain))
+
+    def match(self, host):
+        """True if host or any parent domain is listed (a.b.tracker.com -> tracker.com)"""
+        if not self.hashes:
+            return False
+        # Bare TLDs are never listed, skip probing them
+        return any(self.contains_hash(domain_hash(d))
+                   for d in host_suffixes(host) if "." in d)
+
+
+def pattern_to_regex(pattern):
+    """Translate an Adblock Plus URL pattern into a regular expression"""
+    if len(pattern) > 1 and pattern.startswith("/") and pattern.endswith("/"):
+        return pattern[1:-1]
+
+    regex = []
+    if pattern.startswith("||"):
+        regex.append(_DOMAIN_ANCHOR)
+        pattern = pattern[2:]
+    elif pattern.startswith("|"):
+        regex.append("^")
+        pattern = pattern[1:]
+
+    end_anchor = pattern.endswith("|")
+    if end_anchor:
+        pattern = pattern[:-1]
+
+    for char in pattern:
+        if char == "*":
+            regex.append(".*")
+        elif char == "^":
+            regex.append(_SEPARATOR)
+        else:
+            regex.append(re.escape(char))
+
+    if end_anchor:
+        regex.append("$")
+    return "".join(regex)
+
+
+def pattern_tokens(pattern):
+    """Literal tokens that any URL matched by the pattern must contain whole
+
+    A token only counts if nothing but a separator or an anchor can sit next
+    to it, otherwise the URL may continue the token (``ads.js`` also matches
+    ``loads.js``) and it would never be found by the URL tokenizer.
+    """
+    if pattern.startswith("/") and pattern.endswith("/"):
+        return []
+    anchored = pattern.startswith("|")
+    body = pattern.lstrip("|")
+    tokens = []
+    for match in _TOKEN_RE.finditer(body):
+        start, end = match.span()
+        before = body[start - 1] if start else ("|" if anchored else "*")
+        after = body[end] if end < len(body) else ("|" if body.endswith("|") else "*")
+        if before == "*" or after == "*":
+            continue
+        tokens.append(match.group())
+    return tokens
+
+
+class Rule:
+    """A single compiled network filter"""
+
+    __slots__ = ("text", "exception", "regex_source", "match_case", "types",
+                 "party", "include_domains", "exclude_domains", "_regex")
+
+    def __init__(self, text, exception, regex_source, match_case=False,
+                 types=DEFAULT_TYPES, party=None, include_domains=(),
+                 exclude_domains=()):
+        self.text = text
+        self.exception = exception
+        self.regex_source = regex_source
+        self.match_case = match_case
+        self.types = types
+        # None matches any party, True only third-party, False only first-party
+        self.party = party
+        self.include_domains = frozenset(include_domains)
+        self.exclude_domains = frozenset(exclude_domains)
+        self._regex = None
+
+    def as_tuple(self):
+        return (self.text, self.exception, self.regex_source, self.match_case,
+                self.types, self.party, tuple(self.include_domains),
+                tuple(self.exclude_domains))
+
+    @property
+    def regex(self):
+        if self._regex is None:
+            flags = 0 if self.match_case else re.IGNORECASE
+            self._regex = re.compile(self.regex_source, flags)
+        return self._regex
+
+    def matches_options(self, type_bit, third_party, first_party_host):
+        if not self.types & type_bit:
+            return False
+        if self.party is not None and self.party != third_party:
+            return False
+        if self.include_domains or self.exclude_domains:
+            suffixes = list(host_suffixes(first_party_host or ""))
+            if any(d in self.exclude_domains for d in suffixes):
+                return False
+            if self.include_domains and not any(d in self.include_domains for d in suffixes):
+                return False
+        return True
+
+    def matches(self, url, type_bit, third_party, first_party_host):
+        if not self.matches_options(type_bit, third_party, first_party_host):
+            return False
+        if self.regex_source is None:
+            return True
+        return self.regex.search(url) is not None
+
+
+def parse_options(option_text):
+    """Parse the part after ``$``; returns None for unsupported options"""
+    include_types = 0
+    exclude_types = 0
+    unsupported_types = False
+    party = None
+    match_case = False
+    include_domains = []
+    exclude_domains = []
+
+    for option in option_text.lower().split(","):
+        option = option.strip()
+        negated = option.startswith("~")
+        name = option[1:] if negated else option
+        name = TYPE_ALIASES.get(name, name)
+
+        if name in RESOURCE_TYPES:
+            if negated:
+                exclude_types |= RESOURCE_TYPES[name]
+            else:
+                include_types |= RESOURCE_TYPES[name]
+        elif name in UNSUPPORTED_TYPES:
+            # Excluding a type we never see changes nothing
+            unsupported_types = unsupported_types or not negated
+        elif name == "third-party":
+            party = not negated
+        elif name == "first-party":
+            party = negated
+        elif name == "match-case":
+            match_case = True
+        elif name.startswith("domain="):
+            for domain in name[7:].split("|"):
+                if domain.startswith("~"):
+                    exclude_domains.append(domain[1:])
+                elif domain:
+                    include_domains.append(domain)
+        elif option in IGNORED_OPTIONS:
+            continue
+        else:
+            return None
+
+    if unsupported_types and not include_types:
+        return None
+    types = include_types or DEFAULT_TYPES
+    if exclude_types:
+        types = (include_types or ALL_TYPES) & ~exclude_types
+    return {
+        "types": types,
+        "party": party,
+        "match_case": match_case,
+        "include_domains": include_domains,
+        "exclude_domains": exclude_domains,
+    }
+
+
+def parse_rule(line):
+    """Split a filter list line into (pattern, exception, options)
+
+    Returns None for comments, cosmetic filters and rules using options we
+    cannot honour, so they are skipped rather than applied too broadly.
+    """
+    line = line.strip()
+    if not line or line.startswith(("!", "[")):
+        return None
+    if "##" in line or "#@#" in line or "#?#" in line or "#$#" in line:
+        return None  # cosmetic filter
+
+    exception = line.startswith("@@")
+    if exception:
+        line = line[2:]
+
+    options = {}
+    dollar = line.rfind("$")
+    if dollar >= 0 and not (line.startswith("/") and line.endswith("/")):
+        options = parse_options(line[dollar + 1:])
+        if options is None:
+            return None
+        if exception and options["types"] & RESOURCE_TYPES["document"]:
+            # "@@...$document" allowlists every request made by a page, which
+            # the interceptor cannot tell from its host alone; the document
+            # type is dropped from exceptions, and so is an exception that
+            # had no other type
+            options["types"] &= ~RESOURCE_TYPES["document"]
+            if not options["types"]:
+                return None
+        line = line[:dollar]
+
+    if not line.strip("*"):
+        line = ""
+    return line, exception, options
+
+
+class VerdictCache:
+    """Bounded LRU of host-level verdicts keyed by (host, first party, type)
+
+    Only the request interceptor thread touches it, so it takes no lock.
+    """
+
+    def __init__(self, max_size=VERDICT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        verdict = self._entries.get(key)
+        if verdict is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return verdict
+
+    def put(self, key, verdict):
+        self._entries[key] = verdict
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RuleSet:
+    """Compiled filter rules answering should_block() per request
+
+    Plain ``||host^`` rules and hosts-file entries live in a HostBlocklist,
+    host rules with options in a dict; both are probed once per label of the
+    request host. Every other rule is filed under its rarest
+    literal token, so a request only tests the few rules sharing a token
+    with its URL instead of the whole list.
+
+    A RuleSet loaded from the cache file maps index keys to (offset, length)
+    slices of the memory-mapped file instead, and decodes a bucket the first
+    time a request touches it.
+
+    Once built, the rules never change: reloading builds a new RuleSet and
+    swaps it in, so readers never see a half-built set. Decoded buckets and
+    the verdict cache are per-snapshot memoization and die with it.
+    """
+
+    INDEXES = ("block_hosts", "allow_hosts", "block_tokens", "allow_tokens")
+
+    def __init__(self):
+        self.plain_hosts = HostBlocklist()
+        self.block_hosts = {}
+        self.allow_hosts = {}
+        self.block_tokens = {}
+        self.allow_tokens = {}
+        self.block_generic = []
+        self.allow_generic = []
+        self.rule_count = 0
+        self.stale = False
+        self.verdicts = VerdictCache()
+        self._buffer = None
+
+    @classmethod
+    def from_lines(cls, lines, hosts=()):
+        ruleset = cls()
+        token_rules = []
+        token_counts = {}
+        plain_hosts = array("Q")
+        for domain in hosts:
+            plain_hosts.append(domain_hash(domain))
+            ruleset.rule_count += 1
+
+        for line in lines:
+            parsed = parse_rule(line)
+            if parsed is None:
+                continue
+            pattern, exception, options = parsed
+            lowered = pattern.lower()
+
+            host_match = _HOST_RULE_RE.match(lowered)
+            if host_match and not exception and not options:
+                plain_hosts.append(domain_hash(host_match.group(1)))
+                ruleset.rule_count += 1
+                continue
+            if host_match:
+                rule = Rule(line.strip(), exception, None, **options)
+                index = ruleset.allow_hosts if exception else ruleset.block_hosts
+                index.setdefault(host_match.group(1), []).append(rule)
+                ruleset.rule_count += 1
+                continue
+
+            try:
+                regex_source = pattern_to_regex(pattern) if pattern else None
+                if regex_source is not None:
+                    re.compile(regex_source)
+            except re.error:
+                continue
+
+            rule = Rule(line.strip(), exception, regex_source, **options)
+            tokens = pattern_tokens(lowered)
+            for token in tokens:
+                token_counts[token] = token_counts.get(token, 0) + 1
+            token_rules.append((rule, tokens))
+
+        for rule, tokens in token_rules:
+            ruleset.rule_count += 1
+            if not tokens:
+                if rule.exception:
+                    ruleset.allow_generic.append(rule)
+                else:
+                    ruleset.block_generic.append(rule)
+                continue
+            token = min(tokens, key=lambda t: (token_counts[t], -len(t)))
+            index = ruleset.allow_tokens if rule.exception else ruleset.block_tokens
+            index.setdefault(token, []).append(rule)
+
+        ruleset.plain_hosts = HostBlocklist.from_hashes(plain_hosts)
+        return ruleset
+
+    @classmethod
+    def from_files(cls, paths, hosts_paths=(), extra_lines=()):
+        def lines():
+            yield from extra_lines
+            for path in paths:
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    yield from f
+
+        def hosts():
+            for path in hosts_paths:
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    for line in f:
+                        yield from parse_hosts_line(line)
+
+        return cls.from_lines(lines(), hosts())
+
+    def _bucket(self, index, key):
+        rules = index.get(key)
+        if type(rules) is tuple:
+            offset, length = rules
+            chunk = self._buffer[offset:offset + length]
+            rules = [Rule(*fields) for fields in marshal.loads(chunk)]
+            index[key] = rules
+        return rules
+
+    def _match_hosts(self, index, host, type_bit, third_party, first_party_host):
+        for suffix in host_suffixes(host):
+            rules = self._bucket(index, suffix)
+            if rules and any(r.matches_options(type_bit, third_party, first_party_host)
+                             for r in rules):
+                return True
+        return False
+
+    def _match_tokens(self, index, generic, url, tokens, type_bit, third_party,
+                      first_party_host):
+        for token in tokens:
+            rules = self._bucket(index, token)
+            if rules and any(r.matches(url, type_bit, third_party, first_party_host)
+                             for r in rules):
+                return True
+        return any(r.matches(url, type_bit, third_party, first_party_host)
+                   for r in generic)
+
+    def host_verdict(self, host, first_party_host, type_bit, third_party):
+        """Outcome of the rules that only look at the request host"""
+        if self._match_hosts(self.allow_hosts, host, type_bit, third_party, first_party_host):
+            return HOST_ALLOW
+        if ((type_bit & DEFAULT_TYPES and self.plain_hosts.match(host))
+                or self._match_hosts(self.block_hosts, host, type_bit, third_party,
+                                     first_party_host)):
+            return HOST_BLOCK
+        return HOST_NONE
+
+    def should_block(self, url, host, first_party_host="", resource_type="other"):
+        """Return True if the request must be blocked"""
+        host = host.lower().rstrip(".")
+        first_party_host = (first_party_host or "").lower()
+        type_bit = RESOURCE_TYPES.get(resource_type, RESOURCE_TYPES["other"])
+        third_party = is_third_party(host, first_party_host)
+
+        key = (host, first_party_host, resource_type)
+        verdict = self.verdicts.get(key)
+        if verdict is None:
+            verdict = self.host_verdict(host, first_party_host, type_bit, third_party)
+            self.verdicts.put(key, verdict)
+        if verdict == HOST_ALLOW:
+            return False
+
+        # Path rules and URL exceptions depend on the full URL, not just the host
+        tokens = set(_TOKEN_RE.findall(url.lower()))
+        blocked = verdict == HOST_BLOCK or self._match_tokens(
+            self.block_tokens, self.block_generic, url, tokens, type_bit, third_party,
+            first_party_host)
+        if not blocked:
+            return False
+        return not self._match_tokens(self.allow_tokens, self.allow_generic, url, tokens,
+                                      type_bit, third_party, first_party_host)
+
+    def save_cache(self, path, stat_digest, content_digest):
+        """Write the compiled rules to a versioned cache file"""
+        hashes = array("Q", self.plain_hosts.hashes)
+        offsets = array("I", self.plain_hosts.offsets)
+        if sys.byteorder != "little":
+            hashes.byteswap()
+            offsets.byteswap()
+
+        body = bytearray()
+        base = _CACHE_HEADER.size + len(hashes) * 8 + len(offsets) * 4
+        base += -base % 8
+        directory = {"rule_count": self.rule_count}
+        for name in self.INDEXES:
+            entries = {}
+            for key in getattr(self, name):
+                chunk = marshal.dumps([r.as_tuple() for r in self._bucket(getattr(self, name), key)])
+                entries[key] = (base + len(body), len(chunk))
+                body += chunk
+            directory[name] = entries
+        directory["block_generic"] = [r.as_tuple() for r in self.block_generic]
+        directory["allow_generic"] = [r.as_tuple() for r in self.allow_generic]
+        directory_chunk = marshal.dumps(directory)
+
+        header = _CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, 1, stat_digest,
+                                    content_digest, len(hashes), base + len(body),
+                                    len(directory_chunk))
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(header)
+            f.write(hashes.tobytes())
+            f.write(offsets.tobytes())
+            f.write(b"\0" * (base - f.tell()))
+            f.write(body)
+            f.write(directory_chunk)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load_cache(cls, path, sources, allow_stale=False):
+        """Map a cache file built from the given sources, or return None if stale
+
+        The host hash arrays are used in place from the mapping; rule buckets
+        are decoded lazily by _bucket(). With allow_stale, a cache built from
+        older lists is returned with ``stale`` set instead of None.
+        """
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            header = _CACHE_HEADER.unpack_from(buffer)
+        except struct.error:
+            return None
+        magic, version, little_endian, stat_digest, content_digest, count, dir_offset, dir_length = header
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            return None
+        if little_endian != (sys.byteorder == "little"):
+            return None
+        stale = False
+        current_stat_digest = sources_stat_digest(sources)
+        if stat_digest != current_stat_digest:
+            # Touched but unchanged lists are still a hit; remember their new
+            # stats so the contents are not hashed again on the next launch
+            if content_digest != sources_content_digest(sources):
+                if not allow_stale:
+                    return None
+                stale = True
+            else:
+                try:
+                    with open(path, "r+b") as f:
+                        f.seek(12)
+                        f.write(current_stat_digest)
+                except OSError:
+                    pass
+
+        view = memoryview(buffer)
+        hashes_end = _CACHE_HEADER.size + count * 8
+        offsets_end = hashes_end + ((1 << HostBlocklist.BUCKET_BITS) + 1) * 4
+        try:
+            directory = marshal.loads(view[dir_offset:dir_offset + dir_length])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+        ruleset = cls()
+        ruleset._buffer = view
+        ruleset.plain_hosts = HostBlocklist(view[_CACHE_HEADER.size:hashes_end].cast("Q"),
+                                            view[hashes_end:offsets_end].cast("I"))
+        for name in cls.INDEXES:
+            setattr(ruleset, name, directory[name])
+        ruleset.block_generic = [Rule(*fields) for fields in directory["block_generic"]]
+        ruleset.allow_generic = [Rule(*fields) for fields in directory["allow_generic"]]
+        ruleset.rule_count = directory["rule_count"]
+        ruleset.stale = stale
+        return ruleset
+
+
+def sources_stat_digest(sources):
+    """Cheap fingerprint of the filter lists from their size and mtime"""
+    stats = [CACHE_VERSION, DEFAULT_FILTERS]
+    for path in sources:
+        st = os.stat(path)
+        stats.append((path, st.st_size, st.st_mtime_ns))
+    return hashlib.blake2b(repr(stats).encode("utf-8"), digest_size=16).digest()
+
+
+def sources_content_digest(sources):
+    """Hash of the built-in rules and the contents of every filter list"""
+    digest = hashlib.blake2b(digest_size=32)
+    digest.update(repr((CACHE_VERSION, DEFAULT_FILTERS)).encode("utf-8"))
+    for path in sources:
+        digest.update(path.encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.digest()
+
+
+def filter_list_paths(directory=FILTER_LIST_DIR):
+    """Filter lists (*.txt) installed in the filters directory"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith(".txt"))
+
+
+def hosts_file_paths(directory=FILTER_LIST_DIR):
+    """Hosts-file blocklists (hosts, *.hosts) installed in the filters directory"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name == "hosts" or name.endswith(".hosts"))
+
+
+def load_cached_rules(directory=FILTER_LIST_DIR, cache_path=None):
+    """Rules usable immediately at startup, without parsing any list
+
+    Returns the cached rules, possibly stale, or just the built-in rules if
+    there is no usable cache; ``stale`` is set when a rebuild is needed.
+    """
+    sources = filter_list_paths(directory) + hosts_file_paths(directory)
+    ruleset = None
+    if cache_path:
+        ruleset = RuleSet.load_cache(cache_path, sources, allow_stale=True)
+    if ruleset is None:
+        ruleset = RuleSet.from_lines(DEFAULT_FILTERS)
+        ruleset.stale = bool(sources)
+    return ruleset
+
+
+def load_rules(directory=FILTER_LIST_DIR, cache_path=None):
+    """Compile the built-in rules plus every installed filter list and hosts file
+
+    With a cache_path the compiled rules are reused from the cache file as
+    long as the lists have not changed, and the cache is rewritten otherwise.
+    """
+    filter_paths = filter_list_paths(directory)
+    hosts_paths = hosts_file_paths(directory)
+    sources = filter_paths + hosts_paths
+
+    if cache_path:
+        ruleset = RuleSet.load_cache(cache_path, sources)
+        if ruleset is not None:
+            return ruleset
+
+    ruleset = RuleSet.from_files(filter_paths, hosts_paths, DEFAULT_FILTERS)
+    if cache_path:
+        try:
+            ruleset.save_cache(cache_path, sources_stat_digest(sources),
+                               sources_content_digest(sources))
+        except OSError as e:
+            print(f"Error writing ad block cache: {e}")
+    return ruleset
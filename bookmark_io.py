@@ -0,0 +1,284 @@
+import html
+import json
+import os
+from html.parser import HTMLParser
+
+# Bookmarks are imported and exported as (folder, title, url) records, with
+# folder None for the bookmark bar. A record without a url only makes sure
+# the folder exists. Folders are flat, so nested folders from other browsers
+# become one folder named after the whole path.
+FOLDER_SEPARATOR = " / "
+# Bytes read from an import file at a time
+READ_CHUNK_SIZE = 1 << 16
+
+IMPORT_FORMATS = "Bookmark files (*.html *.htm *.json places.sqlite *.sqlite)"
+EXPORT_FORMATS = "Bookmarks HTML (*.html);;Bookmarks JSON (*.json)"
+
+# Bookmarks and folders below Firefox's root folders. Bookmarks directly in
+# a root land on the bar; folders are named after their path below the root.
+FIREFOX_ROOTS = ("root________", "menu________", "toolbar_____",
+                 "unfiled_____", "mobile______")
+FIREFOX_BOOKMARKS_QUERY = f'''
+    WITH RECURSIVE folders (id, path) AS (
+        SELECT id, NULL FROM places.moz_bookmarks
+        WHERE guid IN ({", ".join("?" * len(FIREFOX_ROOTS))})
+        UNION ALL
+        SELECT b.id, COALESCE(f.path || ?, '') || COALESCE(b.title, '')
+        FROM places.moz_bookmarks b JOIN folders f ON b.parent = f.id
+        WHERE b.type = 2 AND b.guid NOT IN ({", ".join("?" * len(FIREFOX_ROOTS))})
+    )
+    SELECT f.path, NULL, NULL FROM folders f WHERE f.path IS NOT NULL
+    UNION ALL
+    SELECT f.path, b.title, p.url
+    FROM places.moz_bookmarks b
+    JOIN folders f ON b.parent = f.id
+    JOIN places.moz_places p ON p.id = b.fk
+    WHERE b.type = 1 AND p.url NOT LIKE 'place:%'
+'''
+
+def folder_path(parent, name):
+    return name if parent is None else parent + FOLDER_SEPARATOR + name
+
+class NetscapeParser(HTMLParser):
+    """Incremental parser for the Netscape bookmark HTML all browsers export
+
+    Folders are <H3> headings followed by a <DL> list; the folder flagged
+    PERSONAL_TOOLBAR_FOLDER maps onto the bookmark bar.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.records = []
+        self.folders = []
+        self.heading = None
+        self.toolbar_heading = False
+        self.pending_folder = None
+        self.link = None
+        self.text = []
+
+    def current_folder(self):
+        return self.folders[-1] if self.folders else None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "h3":
+            self.heading = []
+            self.toolbar_heading = any(name == "personal_toolbar_folder" for name, value in attrs)
+        elif tag == "a":
+            self.link = dict(attrs).get("href")
+            self.text = []
+        elif tag == "dl":
+            # A list without a heading (the outermost one) stays in its parent
+            folder = self.current_folder()
+            if self.pending_folder is not None:
+                folder = self.pending_folder or None
+            self.folders.append(folder)
+            self.pending_folder = None
+
+    def handle_endtag(self, tag):
+        if tag == "h3" and self.heading is not None:
+            name = "".join(self.heading).strip()
+            if self.toolbar_heading:
+                # Empty string: "the bar", as opposed to None for "no heading"
+                self.pending_folder = ""
+            else:
+                self.pending_folder = folder_path(self.current_folder(), name)
+                self.records.append((self.pending_folder, None, None))
+            self.heading = None
+        elif tag == "a" and self.link is not None:
+            title = "".join(self.text).strip()
+            if self.link.startswith(("http://", "https://", "ftp://", "file://")):
+                self.records.append((self.current_folder(), title or self.link, self.link))
+            self.link = None
+        elif tag == "dl" and self.folders:
+            self.folders.pop()
+
+    def handle_data(self, data):
+        if self.heading is not None:
+            self.heading.append(data)
+        elif self.link is not None:
+            self.text.append(data)
+
+def iter_netscape_bookmarks(path):
+    """Records from a bookmark HTML file, read a chunk at a time"""
+    parser = NetscapeParser()
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if chunk:
+                parser.feed(chunk)
+            else:
+                parser.close()
+            yield from parser.records
+            parser.records = []
+            if not chunk:
+                return
+
+class JSONStream:
+    """Pulls JSON values one at a time out of a file read in chunks"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        chunk = self.f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character, or "" at the end of the file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def take(self, expected):
+        char = self.peek()
+        if char not in expected:
+            raise ValueError(f"Malformed JSON: expected {expected!r}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+def iter_json_array(f):
+    """Elements of a top-level JSON array, parsed one at a time"""
+    stream = JSONStream(f)
+    stream.take("[")
+    if stream.peek() == "]":
+        return
+    while True:
+        yield stream.value()
+        if stream.take(",]") == "]":
+            return
+
+def iter_json_items(f):
+    """(key, element) for every element of the arrays in a top-level object"""
+    stream = JSONStream(f)
+    stream.take("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.take(":")
+        if stream.peek() == "[":
+            stream.take("[")
+            if stream.peek() == "]":
+                stream.take("]")
+            else:
+                while True:
+                    yield key, stream.value()
+                    if stream.take(",]") == "]":
+                        break
+        else:
+            stream.value()
+        if stream.take(",}") == "}":
+            return
+
+def iter_json_bookmarks(path):
+    """Records from a JSON file in the browser_bookmarks.json layout"""
+    with open(path, "r", encoding="utf-8") as f:
+        for key, item in iter_json_items(f):
+            if key == "folders" and item.get("name"):
+                yield item["name"], None, None
+            elif key == "bookmarks" and item.get("url"):
+                folder = item.get("folder")
+                if folder == "No Folder":
+                    folder = None
+                yield folder, item.get("title") or item["url"], item["url"]
+
+class NetscapeWriter:
+    """Writes bookmark HTML that other browsers can import"""
+
+    def __init__(self, f):
+        self.f = f
+        self.folder = None
+        self.pending_folders = []
+
+    def begin(self, folders):
+        self.pending_folders = list(folders)
+        self.f.write(
+            "<!DOCTYPE NETSCAPE-Bookmark-file-1>\n"
+            '<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">\n'
+            "<TITLE>Bookmarks</TITLE>\n<H1>Bookmarks</H1>\n<DL><p>\n"
+            '    <DT><H3 PERSONAL_TOOLBAR_FOLDER="true">Bookmarks bar</H3>\n'
+            "    <DL><p>\n"
+        )
+
+    def open_folder(self, folder):
+        self.f.write("    </DL><p>\n")
+        self.f.write(f"    <DT><H3>{html.escape(folder)}</H3>\n    <DL><p>\n")
+        self.folder = folder
+        if folder in self.pending_folders:
+            self.pending_folders.remove(folder)
+
+    def bookmark(self, folder, title, url):
+        # Bookmarks arrive grouped by folder, bar first
+        if folder != self.folder:
+            self.open_folder(folder)
+        self.f.write(f'        <DT><A HREF="{html.escape(url)}">{html.escape(title or url)}</A>\n')
+
+    def end(self):
+        for folder in list(self.pending_folders):
+            self.open_folder(folder)
+        self.f.write("    </DL><p>\n</DL><p>\n")
+
+class JSONWriter:
+    """Writes the browser_bookmarks.json layout one entry per line"""
+
+    def __init__(self, f):
+        self.f = f
+        self.first = True
+
+    def begin(self, folders):
+        entries = ",\n".join(json.dumps({"name": folder}) for folder in folders)
+        self.f.write('{"folders": [\n' + entries + '\n],\n"bookmarks": [\n')
+
+    def bookmark(self, folder, title, url):
+        entry = json.dumps({"title": title, "url": url, "folder": folder or "No Folder"})
+        self.f.write(entry if self.first else ",\n" + entry)
+        self.first = False
+
+    def end(self):
+        self.f.write("\n]}\n")
+
+def import_bookmarks(db, path, progress=None):
+    """Import a bookmark HTML, JSON or Firefox places.sqlite file
+
+    Runs on the database thread when called from it (see Database.submit);
+    progress is called with the number of bookmarks imported so far.
+    Returns the number of bookmarks imported.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".html", ".htm"):
+        return db.import_bookmarks(iter_netscape_bookmarks(path), progress)
+    if extension == ".json":
+        return db.import_bookmarks(iter_json_bookmarks(path), progress)
+    if extension == ".sqlite":
+        return db.import_firefox_bookmarks(path, progress)
+    raise ValueError(f"Unsupported bookmark file: {path}")
+
+def export_bookmarks(db, path, progress=None):
+    """Write all bookmarks to an HTML or JSON file, chosen by extension"""
+    writer_class = JSONWriter if path.lower().endswith(".json") else NetscapeWriter
+    with open(path, "w", encoding="utf-8") as f:
+        return db.export_bookmarks(writer_class(f), progress)
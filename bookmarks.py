@@ -1,9 +1,21 @@
 from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QPushButton, 
                            QTableWidget, QTableWidgetItem, QLineEdit, QLabel,
-                           QComboBox, QInputDialog, QMainWindow)
-from PyQt5.QtCore import Qt
+                           QComboBox, QInputDialog, QMainWindow, QFileDialog,
+                           QMessageBox, QProgressDialog)
+from PyQt5.QtCore import Qt, QTimer, QObject, pyqtSignal
 from themes import apply_theme
-import json
+import bookmark_io
+
+class ProgressRelay(QObject):
+    """Carries progress counts from the database thread to the GUI thread"""
+    progressed = pyqtSignal(int)
+
+def catch_errors(fn, *args):
+    """Run fn, returning (result, None) or (None, error) instead of raising"""
+    try:
+        return fn(*args), None
+    except Exception as e:
+        return None, e
 
 class BookmarkManager(QDialog):
     def __init__(self, parent=None):
@@ -24,8 +36,11 @@ class BookmarkManager(QDialog):
         self.title_input.setPlaceholderText("Title")
         self.url_input = QLineEdit()
         self.url_input.setPlaceholderText("URL")
-        add_button = QPushButton("Add")
-        add_button.clicked.connect(self.add_bookmark)
+        self.add_button = QPushButton("Add")
+        self.add_button.clicked.connect(self.add_bookmark)
+        # Id of the bookmark being edited; Add saves over it while set
+        self.editing_id = None
+        self.editing_folder_id = None
         
         add_layout.addWidget(QLabel("Title:"))
         add_layout.addWidget(self.title_input)
@@ -33,7 +48,7 @@ class BookmarkManager(QDialog):
         add_layout.addWidget(self.url_input)
         add_layout.addWidget(QLabel("Folder:"))
         self.folder_combo = QComboBox()
-        self.folder_combo.addItem("No Folder")
+        self.folder_combo.addItem("No Folder", None)
         add_layout.addWidget(self.folder_combo)
         
         add_folder_button = QPushButton("New Folder")
@@ -45,10 +60,21 @@ class BookmarkManager(QDialog):
         delete_folder_button.clicked.connect(self.delete_folder)
         add_layout.addWidget(delete_folder_button)
         
-        add_layout.addWidget(add_button)
+        add_layout.addWidget(self.add_button)
         
         layout.addLayout(add_layout)
         
+        # Search box; matches replace the table contents while it has text
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search bookmarks")
+        self.search_input.setClearButtonEnabled(True)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.load_bookmarks)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        layout.addWidget(self.search_input)
+        
         # Bookmarks table
         self.table = QTableWidget()
         self.table.setColumnCount(3)
@@ -62,11 +88,17 @@ class BookmarkManager(QDialog):
         edit_button.clicked.connect(self.edit_bookmark)
         delete_button = QPushButton("Delete")
         delete_button.clicked.connect(self.delete_bookmark)
+        import_button = QPushButton("Import...")
+        import_button.clicked.connect(self.import_bookmarks)
+        export_button = QPushButton("Export...")
+        export_button.clicked.connect(self.export_bookmarks)
         close_button = QPushButton("Close")
         close_button.clicked.connect(self.accept)
         
         button_layout.addWidget(edit_button)
         button_layout.addWidget(delete_button)
+        button_layout.addWidget(import_button)
+        button_layout.addWidget(export_button)
         button_layout.addWidget(close_button)
         layout.addLayout(button_layout)
         
@@ -84,91 +116,145 @@ class BookmarkManager(QDialog):
         if not self.db:
             return
             
-        # Update folder combo
+        self.db.get_bookmark_bar_async(callback=self.populate_bookmarks)
+
+    def populate_bookmarks(self, result):
+        folders, bookmarks = result
+        # Update folder combo; items carry the folder id
+        selected = self.folder_combo.currentData()
+        if self.editing_id is not None:
+            selected = self.editing_folder_id
         self.folder_combo.clear()
-        self.folder_combo.addItem("No Folder")
-        folders = self.db.get_folders()
+        self.folder_combo.addItem("No Folder", None)
         for folder in folders:
-            self.folder_combo.addItem(folder["name"])
+            self.folder_combo.addItem(folder["name"], folder["id"])
+        index = self.folder_combo.findData(selected)
+        self.folder_combo.setCurrentIndex(max(index, 0))
             
-        # Load bookmarks
-        bookmarks = self.db.get_bookmarks()
+        query = self.search_input.text().strip()
+        if query:
+            self.db.search_bookmarks_async(
+                query, callback=lambda results: self.show_search_results(query, results))
+        else:
+            self.fill_table(bookmarks)
+
+    def show_search_results(self, query, bookmarks):
+        # Ignore results for text the user has since changed
+        if query == self.search_input.text().strip():
+            self.fill_table(bookmarks)
+
+    def fill_table(self, bookmarks):
         self.table.setRowCount(len(bookmarks))
         for i, bookmark in enumerate(bookmarks):
-            self.table.setItem(i, 0, QTableWidgetItem(bookmark["title"]))
+            title_item = QTableWidgetItem(bookmark["title"])
+            title_item.setData(Qt.UserRole, bookmark["id"])
+            folder_item = QTableWidgetItem(bookmark.get("folder", "No Folder"))
+            folder_item.setData(Qt.UserRole, bookmark.get("folder_id"))
+            self.table.setItem(i, 0, title_item)
             self.table.setItem(i, 1, QTableWidgetItem(bookmark["url"]))
-            self.table.setItem(i, 2, QTableWidgetItem(bookmark.get("folder", "No Folder")))
+            self.table.setItem(i, 2, folder_item)
 
-    def save_bookmarks(self):
-        bookmarks = {"folders": [], "bookmarks": []}
-        
-        # Save folders
-        for i in range(self.folder_combo.count()):
-            folder_name = self.folder_combo.itemText(i)
-            if folder_name != "No Folder":
-                bookmarks["folders"].append({"name": folder_name})
-        
-        # Save bookmarks
-        for row in range(self.table.rowCount()):
-            bookmark = {
-                "title": self.table.item(row, 0).text(),
-                "url": self.table.item(row, 1).text(),
-                "folder": self.table.item(row, 2).text()
-            }
-            bookmarks["bookmarks"].append(bookmark)
-            
-        with open("browser_bookmarks.json", "w") as f:
-            json.dump(bookmarks, f)
-            
-        # Update browser's bookmark bar if we have a reference
+    def bookmarks_changed(self):
+        self.load_bookmarks()
         if self.browser:
             self.browser.update_bookmark_bar()
             
     def add_folder(self):
         folder_name, ok = QInputDialog.getText(self, "New Folder", "Folder name:")
-        if ok and folder_name:
-            self.folder_combo.addItem(folder_name)
-            self.save_bookmarks()
+        if ok and folder_name and self.db:
+            self.db.add_bookmark_folder_async(folder_name)
+            self.bookmarks_changed()
 
     def delete_folder(self):
-        folder_name = self.folder_combo.currentText()
-        if folder_name != "No Folder":
-            # Remove folder from combo box
-            self.folder_combo.removeItem(self.folder_combo.currentIndex())
-            
-            # Update bookmarks in the table
-            for row in range(self.table.rowCount()):
-                if self.table.item(row, 2).text() == folder_name:
-                    self.table.item(row, 2).setText("No Folder")
-            
-            self.save_bookmarks()
+        folder_id = self.folder_combo.currentData()
+        if folder_id is not None and self.db:
+            # Its bookmarks move back onto the bar
+            self.db.delete_bookmark_folder_async(folder_id)
+            self.bookmarks_changed()
+
+    def start_editing(self, bookmark_id, title, url, folder_id=None):
+        """Load a bookmark into the inputs; Save then updates it in place"""
+        self.editing_id = bookmark_id
+        self.editing_folder_id = folder_id
+        self.title_input.setText(title)
+        self.url_input.setText(url)
+        index = self.folder_combo.findData(folder_id)
+        if index >= 0:
+            self.folder_combo.setCurrentIndex(index)
+        self.add_button.setText("Save")
 
     def add_bookmark(self):
         title = self.title_input.text()
         url = self.url_input.text()
-        folder = self.folder_combo.currentText()
+        folder_id = self.folder_combo.currentData()
         if title and url and self.db:
-            self.db.add_bookmark(title, url, folder if folder != "No Folder" else None)
-            self.load_bookmarks()
+            if self.editing_id is not None:
+                self.db.update_bookmark_async(self.editing_id, title, url, folder_id)
+                self.editing_id = None
+                self.add_button.setText("Add")
+            else:
+                self.db.add_bookmark_async(title, url, folder_id)
             self.title_input.clear()
             self.url_input.clear()
-            if self.browser:
-                self.browser.update_bookmark_bar()
+            self.bookmarks_changed()
             
     def edit_bookmark(self):
         current_row = self.table.currentRow()
         if current_row >= 0:
-            self.title_input.setText(self.table.item(current_row, 0).text())
-            self.url_input.setText(self.table.item(current_row, 1).text())
-            self.table.removeRow(current_row)
-            self.save_bookmarks()
+            self.start_editing(
+                self.table.item(current_row, 0).data(Qt.UserRole),
+                self.table.item(current_row, 0).text(),
+                self.table.item(current_row, 1).text(),
+                self.table.item(current_row, 2).data(Qt.UserRole)
+            )
             
     def delete_bookmark(self):
         current_row = self.table.currentRow()
         if current_row >= 0 and self.db:
-            title = self.table.item(current_row, 0).text()
-            url = self.table.item(current_row, 1).text()
-            self.db.delete_bookmark(title, url)
-            self.load_bookmarks()
-            if self.browser:
-                self.browser.update_bookmark_bar()
+            self.db.delete_bookmark_async(self.table.item(current_row, 0).data(Qt.UserRole))
+            self.bookmarks_changed()
+
+    def run_transfer(self, function, path, label, done_message):
+        """Run an import or export on the database thread behind a progress dialog"""
+        progress = QProgressDialog(label, None, 0, 0, self)
+        progress.setWindowTitle("Bookmarks")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        relay = ProgressRelay(progress)
+        relay.progressed.connect(
+            lambda count: progress.setLabelText(f"{label} {count} bookmarks"))
+
+        def finished(outcome):
+            count, error = outcome
+            progress.close()
+            self.bookmarks_changed()
+            if error is not None:
+                print(f"Error transferring bookmarks: {error}")
+                QMessageBox.warning(self, "Bookmarks", f"{label} failed: {error}")
+            else:
+                QMessageBox.information(self, "Bookmarks", done_message.format(count=count))
+
+        progress.show()
+        self.db.submit(catch_errors, function, self.db, path, relay.progressed.emit,
+                       callback=finished)
+
+    def import_bookmarks(self):
+        if not self.db:
+            return
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Import Bookmarks", "", bookmark_io.IMPORT_FORMATS)
+        if path:
+            self.run_transfer(bookmark_io.import_bookmarks, path, "Importing",
+                              "Imported {count} bookmarks.")
+
+    def export_bookmarks(self):
+        if not self.db:
+            return
+        path, selected = QFileDialog.getSaveFileName(
+            self, "Export Bookmarks", "bookmarks.html", bookmark_io.EXPORT_FORMATS)
+        if not path:
+            return
+        if "." not in path.rsplit("/", 1)[-1]:
+            path += ".json" if "json" in selected.lower() else ".html"
+        self.run_transfer(bookmark_io.export_bookmarks, path, "Exporting",
+                          "Exported {count} bookmarks.")
@@ -0,0 +1,125 @@
+import threading
+
+from public_suffix import registrable_domain, same_site
+
+# Cookies set by these domains or their subdomains are always trackers
+TRACKER_DOMAINS = frozenset({
+    "doubleclick.net", "facebook.com", "google-analytics.com",
+})
+# A cookie domain with one of these as a whole label, or as a hyphen-separated
+# part of one (e.g. "stats.example.com", "ad-tracking.net"), is a tracker
+TRACKER_KEYWORDS = frozenset({
+    "analytics", "tracker", "metrics", "advertising", "pixel",
+    "statistics", "stats", "tracking", "adserver", "monitor",
+})
+
+def cookie_domain(cookie):
+    return cookie.domain().lstrip(".").lower()
+
+def cookie_key(cookie):
+    """What identifies a cookie in the store: name, domain and path"""
+    return bytes(cookie.name()), cookie.domain().lower(), cookie.path() or "/"
+
+def is_tracker(domain):
+    """Suffix-set lookup of the domain and its parents, plus keyword labels"""
+    labels = domain.split(".")
+    for start in range(len(labels)):
+        if ".".join(labels[start:]) in TRACKER_DOMAINS:
+            return True
+    return any(part in TRACKER_KEYWORDS for label in labels for part in label.split("-"))
+
+def is_third_party(domain, first_party_host):
+    """Whether a cookie domain belongs to another site than the page's host"""
+    if not first_party_host or not domain:
+        return False
+    return not same_site(domain, first_party_host)
+
+class CookieIndex:
+    """The cookies kept in the store, keyed by identity and grouped by site
+
+    Adding and removing are dictionary operations, so a page that sets
+    hundreds of cookies costs no more per cookie than one that sets a few.
+    """
+
+    def __init__(self):
+        self.cookies = {}
+        self.by_site = {}
+
+    def __len__(self):
+        return len(self.cookies)
+
+    def add(self, cookie):
+        """Record a stored cookie; False if it only replaced one with the same identity"""
+        key = cookie_key(cookie)
+        is_new = key not in self.cookies
+        self.cookies[key] = cookie
+        if is_new:
+            site = registrable_domain(cookie_domain(cookie))
+            self.by_site.setdefault(site, set()).add(key)
+        return is_new
+
+    def remove(self, cookie):
+        key = cookie_key(cookie)
+        if self.cookies.pop(key, None) is None:
+            return False
+        site = registrable_domain(cookie_domain(cookie))
+        keys = self.by_site.get(site)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_site[site]
+        return True
+
+    def site_cookies(self, site):
+        """Cookies whose domain belongs to the site's registrable domain"""
+        return [self.cookies[key] for key in self.by_site.get(registrable_domain(site), ())]
+
+    def clear(self):
+        self.cookies.clear()
+        self.by_site.clear()
+
+class CookieFilter:
+    """Decides whether a page may read or set cookies, before the store sees them
+
+    Installed with QWebEngineCookieStore.setCookieFilter, so rejected cookies
+    are never written and never reach on_cookie_added. The web engine calls it
+    on its IO thread: it only reads the allowlist, which is replaced whole
+    rather than changed, and keeps its per-site counters under a lock.
+    """
+
+    def __init__(self, allowed_sites=()):
+        self.allowed_sites = frozenset(allowed_sites)
+        self.lock = threading.Lock()
+        # First-party site -> [accepted, rejected]
+        self.counts = {}
+
+    def set_allowed_sites(self, sites):
+        self.allowed_sites = frozenset(sites)
+
+    def is_allowed_site(self, host):
+        return registrable_domain(host) in self.allowed_sites
+
+    def allows(self, domain, first_party_host):
+        """Allowlisted sites may use any cookie; others only their own, non-tracker ones"""
+        if first_party_host and self.is_allowed_site(first_party_host):
+            return True
+        return not (is_third_party(domain, first_party_host) or is_tracker(domain))
+
+    def __call__(self, request):
+        origin = request.origin.host().lower()
+        first_party_host = request.firstPartyUrl.host().lower()
+        accepted = self.allows(origin, first_party_host)
+        site = registrable_domain(first_party_host or origin)
+        with self.lock:
+            counts = self.counts.setdefault(site, [0, 0])
+            counts[0 if accepted else 1] += 1
+        return accepted
+
+    def site_counts(self, host):
+        """(accepted, rejected) cookie accesses on pages of the host's site"""
+        with self.lock:
+            return tuple(self.counts.get(registrable_domain(host), (0, 0)))
+
+    def stats(self):
+        with self.lock:
+            return {site: tuple(counts) for site, counts in self.counts.items()}
@@ -1,16 +1,222 @@
 import sqlite3
+import functools
+import itertools
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from PyQt5.QtCore import QObject, pyqtSignal, Qt
+from bookmark_io import (FIREFOX_BOOKMARKS_QUERY, FIREFOX_ROOTS, FOLDER_SEPARATOR,
+                         iter_json_array, iter_json_bookmarks)
+
+# Connection tuning; the page cache is negative so it is sized in KiB
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -8192",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    # Checkpoints normally happen in checkpoint_if_idle(); this is only a
+    # bound on WAL growth during long busy stretches
+    "PRAGMA wal_autocheckpoint = 10000",
+)
+# Statements kept compiled by the sqlite3 module for this connection
+STATEMENT_CACHE_SIZE = 256
+# Seconds without writes before the WAL is checkpointed
+CHECKPOINT_IDLE_SECONDS = 30
+# Buffered history visits are written once this many are pending, or when
+# the browser's flush timer fires
+HISTORY_FLUSH_SIZE = 50
+# Rows fetched per scroll step by the history view
+HISTORY_PAGE_SIZE = 256
+# Rows returned by a history or bookmark search
+SEARCH_RESULT_LIMIT = 200
+# Newest full-text matches ranked per search; bounds the cost of common words
+SEARCH_CANDIDATE_LIMIT = 1000
+# Rows per executemany batch (and per progress report) when importing or
+# exporting bookmarks
+BOOKMARK_BATCH_SIZE = 1000
+# Legacy history entries written per transaction when migrating
+# browser_history.json; other queued database work runs between batches
+HISTORY_MIGRATION_BATCH_SIZE = 2000
+# Format of the legacy TEXT visit dates and of dates shown in the UI
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Schema upgrades, applied in order; PRAGMA user_version records how many ran
+SCHEMA_MIGRATIONS = (
+    "migrate_history_to_visits",
+    "create_search_indexes",
+    "create_search_queries",
+    "add_bookmark_positions",
+    "create_migration_progress",
+    "create_dns_cache",
+    "create_cookie_allowlist",
+    "add_migration_last_url",
+)
+
+def to_epoch(visit_date):
+    """Convert a legacy "YYYY-MM-DD HH:MM:SS" local time to epoch seconds"""
+    if visit_date is None:
+        return int(time.time())
+    if isinstance(visit_date, (int, float)):
+        return int(visit_date)
+    try:
+        # fromisoformat reads DATE_FORMAT dates many times faster than strptime
+        return int(datetime.fromisoformat(visit_date).timestamp())
+    except ValueError:
+        return 0
+
+def format_epoch(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime(DATE_FORMAT)
+
+def iter_legacy_history(path):
+    """Entries of a browser_history.json file, parsed one at a time"""
+    with open(path, "r", encoding="utf-8") as f:
+        yield from iter_json_array(f)
+
+def fts_query(text):
+    """Turn typed text into an FTS5 query
+
+    Finished words must match exactly; the word still being typed matches
+    as a prefix once it has two characters (the shortest indexed prefix).
+    """
+    words = text.replace('"', " ").split()
+    terms = [f'"{word}"' for word in words]
+    if words and not text[-1].isspace() and len(words[-1]) >= 2:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+def on_db_thread(method):
+    """Run the method on the database thread, blocking until it returns"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if threading.get_ident() == self.thread_id:
+            return method(self, *args, **kwargs)
+        return self.executor.submit(method, self, *args, **kwargs).result()
+    return wrapper
+
+def async_variant(name):
+    """Build a ``<name>_async`` method that queues ``name`` and returns a Future"""
+    def method(self, *args, callback=None, errback=None, **kwargs):
+        return self.submit(getattr(self, name), *args, callback=callback, errback=errback,
+                           **kwargs)
+    method.__name__ = f"{name}_async"
+    method.__doc__ = f"Queue {name}() on the database thread and return a Future"
+    return method
+
+class CallbackDispatcher(QObject):
+    """Hands finished database futures back to the thread that created it
+
+    The callback gets the result; if the call failed, the errback gets the
+    exception instead. Errors raised by either are logged, since an
+    exception escaping a Qt slot aborts the process.
+    """
+    finished = pyqtSignal(object, object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.finished.connect(self.dispatch, Qt.QueuedConnection)
+
+    def dispatch(self, callback, errback, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Database error: {e}")
+            if errback:
+                self.call(errback, e)
+            return
+        if callback:
+            self.call(callback, result)
+
+    def call(self, function, value):
+        try:
+            function(value)
+        except Exception as e:
+            print(f"Error handling database result: {e}")
 
 class Database:
+    """SQLite storage owned by a dedicated database thread
+
+    Plain methods run on that thread and block the caller until they return.
+    The ``*_async`` variants return a Future right away and, if given a
+    callback, call it with the result on the GUI thread (or the errback with
+    the exception, if the call failed).
+    """
+
     def __init__(self):
         self.db_path = "browser.db"
+        # Results are dispatched to whichever thread creates the Database
+        self.dispatcher = CallbackDispatcher()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self.thread_id = self.executor.submit(threading.get_ident).result()
+        self.conn = None
+        self.connect()
+        self.last_write = 0.0
+        self.checkpoint_needed = False
+        # Write-behind history buffer: [title, url, visit_time] visits not yet
+        # inserted, plus title changes for the last URL already written
+        self.pending_history = []
+        self.pending_title_updates = {}
+        self.last_history_url = None
         self.create_tables()
+        self.migrate_schema()
         self.migrate_from_json()
 
+    @on_db_thread
+    def connect(self):
+        # One long-lived connection; the sqlite3 module keeps the statements
+        # used below prepared, so each call only binds and steps
+        self.conn = sqlite3.connect(self.db_path, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+
+    def submit(self, fn, *args, callback=None, errback=None, **kwargs):
+        """Run fn on the database thread; callback gets its result, or errback
+        its exception, on the GUI thread"""
+        future = self.executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda f: self.dispatcher.finished.emit(callback, errback, f))
+        return future
+
+    def close(self):
+        """Flush pending writes, close the connection and stop the database thread"""
+        if self.executor is None:
+            return
+        self.executor.submit(self.close_connection).result()
+        self.executor.shutdown()
+        self.executor = None
+
+    def close_connection(self):
+        if self.conn is None:
+            return
+        try:
+            self.flush_history()
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.conn.execute("PRAGMA optimize")
+        except sqlite3.Error as e:
+            print(f"Error checkpointing database: {e}")
+        self.conn.close()
+        self.conn = None
+
+    def mark_written(self):
+        self.last_write = time.monotonic()
+        self.checkpoint_needed = True
+
+    @on_db_thread
+    def checkpoint_if_idle(self):
+        """Fold the WAL back into the database once writes have gone quiet"""
+        if not self.checkpoint_needed or self.conn is None:
+            return False
+        if time.monotonic() - self.last_write < CHECKPOINT_IDLE_SECONDS:
+            return False
+        self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        self.checkpoint_needed = False
+        return True
+
+    @on_db_thread
     def create_tables(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self.conn as conn:
             cursor = conn.cursor()
             
             # Create settings table
@@ -38,21 +244,189 @@ class Database:
                     FOREIGN KEY (folder_id) REFERENCES bookmark_folders (id)
                 )
             ''')
-            
-            # Create history table
+
+    @on_db_thread
+    def migrate_schema(self):
+        """Bring an older browser.db up to date, one migration per transaction"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, name in enumerate(SCHEMA_MIGRATIONS, start=1):
+            if version >= target:
+                continue
+            with self.conn as conn:
+                # Explicit BEGIN so the DDL is part of the same transaction
+                conn.execute("BEGIN")
+                getattr(self, name)(conn.cursor())
+                # PRAGMA does not take parameters; target is our own integer
+                conn.execute(f"PRAGMA user_version = {target}")
+            version = target
+
+    def migrate_history_to_visits(self, cursor):
+        """Split the flat history table into urls and visits
+
+        Legacy history stored one row per title change, so consecutive rows
+        for the same URL collapse into a single visit keeping the latest title.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS urls (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                title TEXT,
+                visit_count INTEGER NOT NULL DEFAULT 0,
+                last_visit INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS visits (
+                id INTEGER PRIMARY KEY,
+                url_id INTEGER NOT NULL REFERENCES urls (id),
+                visit_time INTEGER NOT NULL
+            )
+        ''')
+
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history'")
+        if cursor.fetchone():
+            # Latest title per URL; SQLite takes bare columns from the MAX(id) row
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT,
-                    url TEXT,
-                    visit_date TIMESTAMP
+                INSERT OR IGNORE INTO urls (url, title)
+                SELECT url, title FROM (
+                    SELECT url, title, MAX(id) FROM history
+                    WHERE url IS NOT NULL GROUP BY url
                 )
             ''')
-            
-            conn.commit()
+            cursor.execute('''
+                INSERT INTO visits (url_id, visit_time)
+                SELECT u.id, r.visit_time FROM (
+                    SELECT id, url,
+                           COALESCE(CAST(strftime('%s', visit_date, 'utc') AS INTEGER), 0)
+                               AS visit_time,
+                           LAG(url) OVER (ORDER BY id) AS previous_url
+                    FROM history WHERE url IS NOT NULL
+                ) r
+                JOIN urls u ON u.url = r.url
+                WHERE r.previous_url IS NULL OR r.previous_url != r.url
+                ORDER BY r.id
+            ''')
+            cursor.execute("DROP TABLE history")
+
+        cursor.execute("CREATE INDEX IF NOT EXISTS visits_visit_time ON visits (visit_time)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS visits_url_id ON visits (url_id, visit_time)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS urls_last_visit ON urls (last_visit)")
+        cursor.execute('''
+            UPDATE urls SET
+                visit_count = (SELECT COUNT(*) FROM visits WHERE url_id = urls.id),
+                last_visit = COALESCE((SELECT MAX(visit_time) FROM visits
+                                       WHERE url_id = urls.id), 0)
+        ''')
+
+    def create_search_indexes(self, cursor):
+        """Full-text indexes over history and bookmark titles and URLs
+
+        Both are external-content FTS5 tables kept in sync by triggers, so
+        every write path updates them without storing the text twice.
+        """
+        for table in ("urls", "bookmarks"):
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+                    title, url, content='{table}', content_rowid='id',
+                    prefix='2 3'
+                )
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {table}_fts (rowid, title, url)
+                    VALUES (new.id, new.title, new.url);
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {table}_fts ({table}_fts, rowid, title, url)
+                    VALUES ('delete', old.id, old.title, old.url);
+                END
+            ''')
+            # Visit counters and folder moves do not touch the indexed text
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF title, url ON {table}
+                WHEN old.title IS NOT new.title OR old.url IS NOT new.url BEGIN
+                    INSERT INTO {table}_fts ({table}_fts, rowid, title, url)
+                    VALUES ('delete', old.id, old.title, old.url);
+                    INSERT INTO {table}_fts (rowid, title, url)
+                    VALUES (new.id, new.title, new.url);
+                END
+            ''')
+            cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+            cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('optimize')")
+
+    def create_search_queries(self, cursor):
+        """Searches typed into the address bar, for its suggestions"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS search_queries (
+                query TEXT PRIMARY KEY,
+                use_count INTEGER NOT NULL DEFAULT 0,
+                last_used INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+    def create_migration_progress(self, cursor):
+        """How far each legacy JSON file has been migrated, for resuming"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS migration_progress (
+                path TEXT PRIMARY KEY,
+                position INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+    def create_dns_cache(self, cursor):
+        """Resolved host addresses kept across restarts, in recency order"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS dns_cache (
+                hostname TEXT NOT NULL,
+                rtype INTEGER NOT NULL,
+                addresses TEXT NOT NULL,
+                expires REAL NOT NULL,
+                recency INTEGER NOT NULL,
+                PRIMARY KEY (hostname, rtype)
+            ) WITHOUT ROWID
+        ''')
+
+    def create_cookie_allowlist(self, cursor):
+        """Sites (registrable domains) whose pages may use any cookies"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cookie_allowlist (
+                site TEXT PRIMARY KEY
+            ) WITHOUT ROWID
+        ''')
 
+    def add_migration_last_url(self, cursor):
+        """The last URL migrated, so a resumed migration still collapses a
+        title change that straddles the point where it stopped"""
+        cursor.execute("ALTER TABLE migration_progress ADD COLUMN last_url TEXT")
+
+    def add_bookmark_positions(self, cursor):
+        """Order bookmarks within their folder and index them for moves"""
+        cursor.execute("ALTER TABLE bookmarks ADD COLUMN position REAL NOT NULL DEFAULT 0")
+        cursor.execute("UPDATE bookmarks SET position = id")
+        # Older versions stored folder names in folder_id and left deleted
+        # folders' ids behind; resolve the names and drop dangling ids
+        cursor.execute('''
+            UPDATE bookmarks SET folder_id =
+                (SELECT id FROM bookmark_folders WHERE name = bookmarks.folder_id)
+            WHERE typeof(folder_id) = 'text'
+        ''')
+        cursor.execute('''
+            UPDATE bookmarks SET folder_id = NULL
+            WHERE folder_id NOT IN (SELECT id FROM bookmark_folders)
+        ''')
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS bookmarks_folder_position ON bookmarks (folder_id, position)"
+        )
+
+    @on_db_thread
     def migrate_from_json(self):
-        """Migrate existing JSON data to SQLite"""
+        """Migrate existing JSON settings and bookmarks to SQLite
+
+        The history file can be much larger and is moved in the background
+        by migrate_history_async() instead.
+        """
         # Migrate settings
         if os.path.exists("browser_settings.json"):
             with open("browser_settings.json", "r") as f:
@@ -62,134 +436,670 @@ class Database:
 
         # Migrate bookmarks
         if os.path.exists("browser_bookmarks.json"):
-            with open("browser_bookmarks.json", "r") as f:
-                bookmarks = json.load(f)
-                # First create folders
-                folder_ids = {}
-                for folder in bookmarks.get("folders", []):
-                    folder_id = self.add_bookmark_folder(folder["name"])
-                    folder_ids[folder["name"]] = folder_id
-                
-                # Then add bookmarks
-                for bookmark in bookmarks.get("bookmarks", []):
-                    folder_name = bookmark.get("folder", "No Folder")
-                    folder_id = folder_ids.get(folder_name) if folder_name != "No Folder" else None
-                    self.add_bookmark(bookmark["title"], bookmark["url"], folder_id)
+            self.import_bookmarks(iter_json_bookmarks("browser_bookmarks.json"))
             os.rename("browser_bookmarks.json", "browser_bookmarks.json.bak")
 
-        # Migrate history
-        if os.path.exists("browser_history.json"):
-            with open("browser_history.json", "r") as f:
-                history = json.load(f)
-                for entry in history:
-                    self.add_history_entry(entry["title"], entry["url"], entry["date"])
-            os.rename("browser_history.json", "browser_history.json.bak")
+    def migrate_history_async(self, progress=None, done=None, path="browser_history.json"):
+        """Move a legacy history file into the database in the background
+
+        The file is parsed one entry at a time and written in batches, each
+        batch in its own transaction together with the number of entries
+        written so far, so an interrupted migration resumes where it stopped.
+        Batches are queued one after another, so other database calls only
+        ever wait for a single batch. progress(count) and done(count) are
+        called on the GUI thread. Returns False when there is nothing to do.
+        """
+        if not os.path.exists(path):
+            self.submit(self.forget_migration, path)
+            return False
+
+        def report(result):
+            if result is None:
+                return
+            count, finished = result
+            if finished and done:
+                done(count)
+            elif not finished and progress:
+                progress(count)
+
+        def migrate_batch(entries):
+            entries, result = self.migrate_history_batch(path, entries)
+            if result is not None and not result[1]:
+                self.submit(migrate_batch, entries, callback=report)
+            return result
+
+        self.submit(migrate_batch, None, callback=report)
+        return True
+
+    def forget_migration(self, path):
+        with self.conn as conn:
+            conn.execute("DELETE FROM migration_progress WHERE path = ?", (path,))
+
+    def migrate_history_batch(self, path, entries):
+        """Write the next batch of a history migration
+
+        Returns the entry iterator to continue from and (entries migrated so
+        far, whether the file is done); the result is None when the database
+        has been closed, in which case the next launch resumes.
+        """
+        if self.conn is None:
+            if entries is not None:
+                entries.close()
+            return None, None
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT position, last_url FROM migration_progress WHERE path = ?",
+                       (path,))
+        row = cursor.fetchone()
+        position, last_url = row if row else (0, None)
+
+        try:
+            if entries is None:
+                entries = iter_legacy_history(path)
+                # Skip what an earlier, interrupted run already wrote
+                for skipped in itertools.islice(entries, position):
+                    pass
+            raw = list(itertools.islice(entries, HISTORY_MIGRATION_BATCH_SIZE))
+        except (OSError, ValueError) as e:
+            # Keep what was readable rather than retrying a broken file forever
+            print(f"Error migrating history: {e}")
+            raw = []
+        finished = len(raw) < HISTORY_MIGRATION_BATCH_SIZE
+
+        position += len(raw)
+        # Legacy history stored one entry per title change; as in
+        # migrate_history_to_visits, consecutive entries for the same URL are
+        # one visit keeping the latest title
+        batch = []
+        retitled = None
+        for entry in raw:
+            if not isinstance(entry, dict) or not entry.get("url"):
+                continue
+            title, url = entry.get("title") or "", entry["url"]
+            if url == last_url:
+                if batch:
+                    batch[-1][0] = title
+                else:
+                    # The visit was written with the previous batch
+                    retitled = (title, url, title)
+                continue
+            last_url = url
+            batch.append([title, url, to_epoch(entry.get("date"))])
+        self.mark_written()
+        with self.conn as conn:
+            conn.execute("BEGIN")
+            cursor = conn.cursor()
+            if retitled:
+                cursor.execute("UPDATE urls SET title = ? WHERE url = ? AND title IS NOT ?",
+                               retitled)
+            index_later = self.defer_search_index(cursor, "urls")
+            self.write_visits(cursor, batch)
+            index_later()
+            cursor.execute('''
+                INSERT INTO migration_progress (path, position, last_url) VALUES (?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    position = excluded.position, last_url = excluded.last_url
+            ''', (path, position, last_url))
+
+        if finished:
+            if entries is not None:
+                entries.close()
+            os.replace(path, path + ".bak")
+            self.forget_migration(path)
+        return entries, (position, finished)
 
     # Settings methods
+    @on_db_thread
     def save_settings(self, settings):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            for key, value in settings.items():
-                cursor.execute(
-                    "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
-                    (key, json.dumps(value))
-                )
-            conn.commit()
+        """Write the given keys only, in one transaction"""
+        self.mark_written()
+        with self.conn as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in settings.items()]
+            )
 
+    @on_db_thread
     def load_settings(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT key, value FROM settings")
-            return {key: json.loads(value) for key, value in cursor.fetchall()}
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT key, value FROM settings")
+        return {key: json.loads(value) for key, value in cursor.fetchall()}
+
+    # DNS cache methods
+    @on_db_thread
+    def save_dns_cache(self, entries):
+        """Replace the saved cache with (hostname, rtype, addresses, expires)
+        entries, least recently used first"""
+        self.mark_written()
+        with self.conn as conn:
+            conn.execute("DELETE FROM dns_cache")
+            conn.executemany(
+                "INSERT INTO dns_cache (hostname, rtype, addresses, expires, recency) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(hostname, rtype, " ".join(addresses), expires, recency)
+                 for recency, (hostname, rtype, addresses, expires) in enumerate(entries)]
+            )
+
+    @on_db_thread
+    def load_dns_cache(self, expired_before):
+        """Saved cache entries that expire after expired_before, least recently used first"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT hostname, rtype, addresses, expires FROM dns_cache "
+            "WHERE expires > ? ORDER BY recency", (expired_before,)
+        )
+        return [(hostname, rtype, tuple(addresses.split()), expires)
+                for hostname, rtype, addresses, expires in cursor.fetchall()]
+
+    # Cookie allowlist methods
+    @on_db_thread
+    def get_cookie_allowlist(self):
+        return [row[0] for row in self.conn.execute("SELECT site FROM cookie_allowlist")]
+
+    @on_db_thread
+    def allow_cookies_for_site(self, site):
+        self.mark_written()
+        with self.conn as conn:
+            conn.execute("INSERT OR IGNORE INTO cookie_allowlist (site) VALUES (?)", (site,))
+
+    @on_db_thread
+    def disallow_cookies_for_site(self, site):
+        self.mark_written()
+        with self.conn as conn:
+            conn.execute("DELETE FROM cookie_allowlist WHERE site = ?", (site,))
 
     # Bookmark methods
+    @on_db_thread
     def add_bookmark_folder(self, name):
-        with sqlite3.connect(self.db_path) as conn:
+        self.mark_written()
+        with self.conn as conn:
             cursor = conn.cursor()
             cursor.execute("INSERT OR IGNORE INTO bookmark_folders (name) VALUES (?)", (name,))
-            conn.commit()
             cursor.execute("SELECT id FROM bookmark_folders WHERE name = ?", (name,))
             return cursor.fetchone()[0]
 
-    def delete_bookmark_folder(self, folder_name):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM bookmark_folders WHERE name = ?", (folder_name,))
-            conn.commit()
+    @on_db_thread
+    def delete_bookmark_folder(self, folder_id):
+        """Delete a folder; its bookmarks move to the end of the bar"""
+        bookmark_ids = [row[0] for row in self.conn.execute(
+            "SELECT id FROM bookmarks WHERE folder_id = ? ORDER BY position", (folder_id,)
+        )]
+        self.mark_written()
+        with self.conn as conn:
+            self.append_to_folder(conn.cursor(), bookmark_ids, None)
+            conn.execute("DELETE FROM bookmark_folders WHERE id = ?", (folder_id,))
+
+    def end_position(self, cursor, folder_id):
+        """Position after the last bookmark in a folder (None for the bar)"""
+        cursor.execute(
+            "SELECT MAX(position) FROM bookmarks WHERE folder_id IS ?", (folder_id,)
+        )
+        return (cursor.fetchone()[0] or 0) + 1
 
+    def append_to_folder(self, cursor, bookmark_ids, folder_id):
+        start = self.end_position(cursor, folder_id)
+        cursor.executemany(
+            "UPDATE bookmarks SET folder_id = ?, position = ? WHERE id = ?",
+            [(folder_id, start + offset, bookmark_id)
+             for offset, bookmark_id in enumerate(bookmark_ids)]
+        )
+
+    @on_db_thread
     def add_bookmark(self, title, url, folder_id=None):
-        with sqlite3.connect(self.db_path) as conn:
+        self.mark_written()
+        with self.conn as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "INSERT INTO bookmarks (title, url, folder_id) VALUES (?, ?, ?)",
-                (title, url, folder_id)
+                "INSERT INTO bookmarks (title, url, folder_id, position) VALUES (?, ?, ?, ?)",
+                (title, url, folder_id, self.end_position(cursor, folder_id))
             )
-            conn.commit()
+            return cursor.lastrowid
 
-    def get_bookmarks(self):
-        with sqlite3.connect(self.db_path) as conn:
+    @on_db_thread
+    def update_bookmark(self, bookmark_id, title, url, folder_id):
+        """Change a bookmark; a new folder puts it at the end of that folder"""
+        self.mark_written()
+        with self.conn as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT b.title, b.url, f.name 
-                FROM bookmarks b 
-                LEFT JOIN bookmark_folders f ON b.folder_id = f.id
-            """)
-            return [{"title": title, "url": url, "folder": folder or "No Folder"}
-                   for title, url, folder in cursor.fetchall()]
+            cursor.execute(
+                "UPDATE bookmarks SET title = ?, url = ? WHERE id = ?",
+                (title, url, bookmark_id)
+            )
+            cursor.execute(
+                "SELECT 1 FROM bookmarks WHERE id = ? AND folder_id IS ?", (bookmark_id, folder_id)
+            )
+            if cursor.fetchone() is None:
+                self.append_to_folder(cursor, [bookmark_id], folder_id)
 
-    def get_folders(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM bookmark_folders")
-            return [{"name": row[0]} for row in cursor.fetchall()]
+    @on_db_thread
+    def move_bookmark(self, bookmark_id, folder_id, before_id=None):
+        """Move a bookmark into a folder (None for the bar), in front of
+        before_id or at the end
 
-    def delete_bookmark(self, title, url):
-        with sqlite3.connect(self.db_path) as conn:
+        The new position is halfway between its neighbours, so only the
+        moved row is written. When repeated moves into the same gap exhaust
+        the float precision the folder is renumbered once.
+        """
+        if before_id == bookmark_id:
+            return
+        self.mark_written()
+        with self.conn as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "DELETE FROM bookmarks WHERE title = ? AND url = ?",
-                (title, url)
+                "SELECT position FROM bookmarks WHERE id = ? AND folder_id IS ?", (before_id, folder_id)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                self.append_to_folder(cursor, [bookmark_id], folder_id)
+                return
+            after = row[0]
+            cursor.execute('''
+                SELECT MAX(position) FROM bookmarks
+                WHERE folder_id IS ? AND position < ? AND id != ?
+            ''', (folder_id, after, bookmark_id))
+            before = cursor.fetchone()[0]
+            before = after - 1 if before is None else before
+            position = (before + after) / 2
+            if not before < position < after:
+                self.renumber_folder(cursor, folder_id)
+                cursor.execute("SELECT position FROM bookmarks WHERE id = ?", (before_id,))
+                position = cursor.fetchone()[0] - 0.5
+            cursor.execute(
+                "UPDATE bookmarks SET folder_id = ?, position = ? WHERE id = ?",
+                (folder_id, position, bookmark_id)
+            )
+
+    @on_db_thread
+    def move_bookmarks(self, bookmark_ids, folder_id):
+        """Append several bookmarks to a folder (None for the bar) at once"""
+        self.mark_written()
+        with self.conn as conn:
+            self.append_to_folder(conn.cursor(), bookmark_ids, folder_id)
+
+    def renumber_folder(self, cursor, folder_id):
+        cursor.execute('''
+            UPDATE bookmarks SET position = ordered.number FROM (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY position, id) AS number
+                FROM bookmarks WHERE folder_id IS ?
+            ) AS ordered
+            WHERE bookmarks.id = ordered.id
+        ''', (folder_id,))
+
+    @on_db_thread
+    def get_bookmarks(self):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT b.id, b.title, b.url, b.folder_id, f.name 
+            FROM bookmarks b 
+            LEFT JOIN bookmark_folders f ON b.folder_id = f.id
+            ORDER BY b.folder_id, b.position
+        """)
+        return [{"id": bookmark_id, "title": title, "url": url,
+                 "folder_id": folder_id if folder else None,
+                 "folder": folder or "No Folder"}
+               for bookmark_id, title, url, folder_id, folder in cursor.fetchall()]
+
+    def defer_search_index(self, cursor, table):
+        """Stop indexing rows inserted into table one by one
+
+        The per-row insert trigger makes bulk inserts several times slower.
+        It is dropped until the returned function is called, which indexes
+        the new rows with a single statement and recreates the trigger. Must
+        run inside an explicit transaction so the trigger cannot stay lost.
+        """
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                       (f"{table}_fts_insert",))
+        trigger_sql = cursor.fetchone()[0]
+        cursor.execute(f"DROP TRIGGER {table}_fts_insert")
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        last_id = cursor.fetchone()[0]
+
+        def index_new_rows():
+            # Rowids only grow, so everything past last_id was inserted since
+            cursor.execute(
+                f"INSERT INTO {table}_fts (rowid, title, url) "
+                f"SELECT id, title, url FROM {table} WHERE id > ?", (last_id,)
             )
-            conn.commit()
+            cursor.execute(trigger_sql)
+        return index_new_rows
 
-    def update_bookmark_folder(self, title, url, new_folder):
-        with sqlite3.connect(self.db_path) as conn:
+    @on_db_thread
+    def import_bookmarks(self, records, progress=None):
+        """Insert (folder, title, url) records in a single transaction
+
+        records may be a generator still parsing its file; rows go to
+        executemany in batches, so memory use does not grow with the import.
+        Missing folders are created, and bookmarks are appended after what
+        each folder already holds. Returns the number of bookmarks added.
+        """
+        folder_ids = {name: folder_id for folder_id, name
+                      in self.conn.execute("SELECT id, name FROM bookmark_folders")}
+        next_positions = {}
+        batch = []
+        count = 0
+        insert = "INSERT INTO bookmarks (title, url, folder_id, position) VALUES (?, ?, ?, ?)"
+        self.mark_written()
+        with self.conn as conn:
+            # Explicit BEGIN so the trigger swap is part of the import
+            conn.execute("BEGIN")
             cursor = conn.cursor()
-            if new_folder == "No Folder":
+            index_later = self.defer_search_index(cursor, "bookmarks")
+            for folder, title, url in records:
                 folder_id = None
-            else:
-                cursor.execute("SELECT id FROM bookmark_folders WHERE name = ?", (new_folder,))
-                result = cursor.fetchone()
-                folder_id = result[0] if result else None
-            
-            cursor.execute(
-                "UPDATE bookmarks SET folder_id = ? WHERE title = ? AND url = ?",
-                (folder_id, title, url)
+                if folder:
+                    folder_id = folder_ids.get(folder)
+                    if folder_id is None:
+                        cursor.execute("INSERT INTO bookmark_folders (name) VALUES (?)", (folder,))
+                        folder_id = folder_ids[folder] = cursor.lastrowid
+                if url is None:
+                    continue
+                position = next_positions.get(folder_id)
+                if position is None:
+                    position = self.end_position(cursor, folder_id)
+                next_positions[folder_id] = position + 1
+                batch.append((title, url, folder_id, position))
+                if len(batch) >= BOOKMARK_BATCH_SIZE:
+                    cursor.executemany(insert, batch)
+                    count += len(batch)
+                    batch = []
+                    if progress:
+                        progress(count)
+            cursor.executemany(insert, batch)
+            count += len(batch)
+            index_later()
+        if progress:
+            progress(count)
+        return count
+
+    @on_db_thread
+    def import_firefox_bookmarks(self, places_path, progress=None):
+        """Import straight from a Firefox profile's places.sqlite
+
+        Firefox locks the file while it runs; close it or import a copy.
+        """
+        self.conn.execute("ATTACH DATABASE ? AS places", (places_path,))
+        try:
+            rows = self.conn.execute(
+                FIREFOX_BOOKMARKS_QUERY, FIREFOX_ROOTS + (FOLDER_SEPARATOR,) + FIREFOX_ROOTS
             )
-            conn.commit()
+            return self.import_bookmarks(rows, progress)
+        finally:
+            self.conn.execute("DETACH DATABASE places")
+
+    @on_db_thread
+    def export_bookmarks(self, writer, progress=None):
+        """Stream every bookmark to writer, bar first and then by folder
+
+        Rows are fetched in batches, so the export never holds the whole
+        collection. Bookmarks whose folder no longer exists are written on
+        the bar. Returns the number of bookmarks written.
+        """
+        writer.begin([name for (name,) in
+                      self.conn.execute("SELECT name FROM bookmark_folders ORDER BY id")])
+        cursor = self.conn.execute('''
+            SELECT f.name, b.title, b.url FROM bookmarks b
+            LEFT JOIN bookmark_folders f ON f.id = b.folder_id
+            ORDER BY f.id IS NOT NULL, b.folder_id, b.position
+        ''')
+        count = 0
+        while True:
+            rows = cursor.fetchmany(BOOKMARK_BATCH_SIZE)
+            if not rows:
+                break
+            for folder, title, url in rows:
+                writer.bookmark(folder, title, url)
+            count += len(rows)
+            if progress:
+                progress(count)
+        writer.end()
+        return count
+
+    @on_db_thread
+    def get_bookmark_bar(self):
+        """Folders and bookmarks in one round trip to the database thread"""
+        return self.get_folders(), self.get_bookmarks()
+
+    @on_db_thread
+    def search_bookmarks(self, text, limit=SEARCH_RESULT_LIMIT):
+        query = fts_query(text)
+        if not query:
+            return []
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT b.id, b.title, b.url, b.folder_id, f.name FROM (
+                SELECT rowid, bm25(bookmarks_fts, 2.0, 1.0) AS score FROM bookmarks_fts
+                WHERE bookmarks_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+            ) m
+            JOIN bookmarks b ON b.id = m.rowid
+            LEFT JOIN bookmark_folders f ON b.folder_id = f.id
+            ORDER BY m.score LIMIT ?
+        ''', (query, SEARCH_CANDIDATE_LIMIT, limit))
+        return [{"id": bookmark_id, "title": title, "url": url,
+                 "folder_id": folder_id if folder else None,
+                 "folder": folder or "No Folder"}
+               for bookmark_id, title, url, folder_id, folder in cursor.fetchall()]
+
+    @on_db_thread
+    def rebuild_search_index(self):
+        """Re-index every history and bookmark entry from scratch"""
+        self.flush_history()
+        self.mark_written()
+        with self.conn as conn:
+            for table in ("urls_fts", "bookmarks_fts"):
+                conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+                conn.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+
+    @on_db_thread
+    def get_folders(self):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id, name FROM bookmark_folders ORDER BY id")
+        return [{"id": folder_id, "name": name} for folder_id, name in cursor.fetchall()]
+
+    @on_db_thread
+    def delete_bookmark(self, bookmark_id):
+        self.mark_written()
+        with self.conn as conn:
+            conn.execute("DELETE FROM bookmarks WHERE id = ?", (bookmark_id,))
 
     # History methods
-    def add_history_entry(self, title, url, visit_date=None):
-        if visit_date is None:
-            visit_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        with sqlite3.connect(self.db_path) as conn:
+    @on_db_thread
+    def queue_history_entry(self, title, url):
+        """Buffer a visit without touching the disk
+
+        Title updates for the page visited last (SPAs retitle constantly)
+        replace the title of its pending or already written visit instead of
+        adding a new one.
+        """
+        if self.pending_history and self.pending_history[-1][1] == url:
+            self.pending_history[-1][0] = title
+            return
+        if not self.pending_history and url == self.last_history_url:
+            self.pending_title_updates[url] = title
+            return
+
+        self.pending_history.append([title, url, int(time.time())])
+        if len(self.pending_history) >= HISTORY_FLUSH_SIZE:
+            self.flush_history()
+
+    @on_db_thread
+    def flush_history(self):
+        """Write all buffered visits in a single transaction"""
+        if not self.pending_history and not self.pending_title_updates:
+            return
+        pending, self.pending_history = self.pending_history, []
+        updates, self.pending_title_updates = self.pending_title_updates, {}
+
+        self.mark_written()
+        with self.conn as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO history (title, url, visit_date) VALUES (?, ?, ?)",
-                (title, url, visit_date)
+            cursor.executemany(
+                "UPDATE urls SET title = ? WHERE url = ?",
+                [(title, url) for url, title in updates.items()]
             )
-            conn.commit()
+            self.write_visits(cursor, pending)
+        if pending:
+            self.last_history_url = pending[-1][1]
 
-    def get_history(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT title, url, visit_date FROM history ORDER BY visit_date DESC")
-            return [{"title": title, "url": url, "date": date}
-                   for title, url, date in cursor.fetchall()]
+    def write_visits(self, cursor, visits):
+        """Insert [title, url, visit_time] visits and update their urls rows
+
+        Visits are folded per URL first, and titles are written separately
+        and only where they changed, so the search index triggers fire once
+        per new or retitled page rather than once per visit.
+        """
+        pages = {}
+        for title, url, visit_time in visits:
+            page = pages.get(url)
+            if page is None:
+                pages[url] = [title, 1, visit_time]
+            else:
+                page[0] = title
+                page[1] += 1
+                page[2] = max(page[2], visit_time)
+        cursor.executemany('''
+            INSERT INTO urls (url, title, visit_count, last_visit) VALUES (?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                visit_count = visit_count + excluded.visit_count,
+                last_visit = MAX(last_visit, excluded.last_visit)
+        ''', [(url, title, count, last_visit)
+              for url, (title, count, last_visit) in pages.items()])
+        cursor.executemany(
+            "UPDATE urls SET title = ? WHERE url = ? AND title IS NOT ?",
+            [(title, url, title) for url, (title, count, last_visit) in pages.items()]
+        )
+        cursor.executemany(
+            "INSERT INTO visits (url_id, visit_time) "
+            "SELECT id, ? FROM urls WHERE url = ?",
+            [(visit_time, url) for title, url, visit_time in visits]
+        )
+
+    @on_db_thread
+    def get_history_page(self, before=None, limit=HISTORY_PAGE_SIZE):
+        """One page of visits, newest first, as (visit_id, visit_time, title, url)
+
+        ``before`` is the (visit_time, visit_id) of the last row already shown;
+        seeking past it on the visit_time index costs the same on any page.
+        """
+        cursor = self.conn.cursor()
+        if before is None:
+            self.flush_history()
+            cursor.execute('''
+                SELECT v.id, v.visit_time, u.title, u.url
+                FROM visits v JOIN urls u ON u.id = v.url_id
+                ORDER BY v.visit_time DESC, v.id DESC LIMIT ?
+            ''', (limit,))
+        else:
+            cursor.execute('''
+                SELECT v.id, v.visit_time, u.title, u.url
+                FROM visits v JOIN urls u ON u.id = v.url_id
+                WHERE (v.visit_time, v.id) < (?, ?)
+                ORDER BY v.visit_time DESC, v.id DESC LIMIT ?
+            ''', (before[0], before[1], limit))
+        return cursor.fetchall()
+
+    @on_db_thread
+    def search_history(self, text, limit=SEARCH_RESULT_LIMIT):
+        """Best matching history URLs as (url_id, last_visit, title, url)"""
+        query = fts_query(text)
+        if not query:
+            return []
+        self.flush_history()
+        cursor = self.conn.cursor()
+        # Title hits weigh double; only the newest matches are scored
+        cursor.execute('''
+            SELECT u.id, u.last_visit, u.title, u.url FROM (
+                SELECT rowid, bm25(urls_fts, 2.0, 1.0) AS score FROM urls_fts
+                WHERE urls_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+            ) m JOIN urls u ON u.id = m.rowid
+            ORDER BY m.score LIMIT ?
+        ''', (query, SEARCH_CANDIDATE_LIMIT, limit))
+        return cursor.fetchall()
 
+    @on_db_thread
+    def get_most_visited_urls(self, limit):
+        """URLs visited most often, most visited first"""
+        self.flush_history()
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT url FROM urls ORDER BY visit_count DESC LIMIT ?", (limit,))
+        return [url for (url,) in cursor.fetchall()]
+
+    @on_db_thread
     def clear_history(self):
-        with sqlite3.connect(self.db_path) as conn:
+        self.pending_history = []
+        self.pending_title_updates = {}
+        self.last_history_url = None
+        self.mark_written()
+        with self.conn as conn:
             cursor = conn.cursor()
-            cursor.execute("DELETE FROM history")
-            conn.commit()
+            cursor.execute("DELETE FROM visits")
+            cursor.execute("DELETE FROM urls")
+            cursor.execute("DELETE FROM search_queries")
+
+    @on_db_thread
+    def record_search_query(self, query):
+        self.mark_written()
+        with self.conn as conn:
+            conn.execute('''
+                INSERT INTO search_queries (query, use_count, last_used) VALUES (?, 1, ?)
+                ON CONFLICT (query) DO UPDATE SET
+                    use_count = use_count + 1, last_used = excluded.last_used
+            ''', (query, int(time.time())))
+
+    @on_db_thread
+    def get_omnibox_entries(self, history_limit):
+        """Everything the address bar suggests from, read in one go
+
+        Returns (url, title, visit_count, last_visit) rows for the most
+        recently visited URLs, (title, url) bookmarks and
+        (query, use_count, last_used) searches.
+        """
+        self.flush_history()
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT url, title, visit_count, last_visit FROM urls
+            ORDER BY last_visit DESC LIMIT ?
+        ''', (history_limit,))
+        urls = cursor.fetchall()
+        cursor.execute("SELECT title, url FROM bookmarks")
+        bookmarks = cursor.fetchall()
+        cursor.execute("SELECT query, use_count, last_used FROM search_queries")
+        return urls, bookmarks, cursor.fetchall()
+
+    # Non-blocking variants for the GUI thread
+    checkpoint_if_idle_async = async_variant("checkpoint_if_idle")
+    save_settings_async = async_variant("save_settings")
+    add_bookmark_folder_async = async_variant("add_bookmark_folder")
+    delete_bookmark_folder_async = async_variant("delete_bookmark_folder")
+    add_bookmark_async = async_variant("add_bookmark")
+    get_bookmark_bar_async = async_variant("get_bookmark_bar")
+    delete_bookmark_async = async_variant("delete_bookmark")
+    update_bookmark_async = async_variant("update_bookmark")
+    move_bookmark_async = async_variant("move_bookmark")
+    move_bookmarks_async = async_variant("move_bookmarks")
+    queue_history_entry_async = async_variant("queue_history_entry")
+    flush_history_async = async_variant("flush_history")
+    get_history_page_async = async_variant("get_history_page")
+    clear_history_async = async_variant("clear_history")
+    search_history_async = async_variant("search_history")
+    search_bookmarks_async = async_variant("search_bookmarks")
+    rebuild_search_index_async = async_variant("rebuild_search_index")
+    record_search_query_async = async_variant("record_search_query")
+    save_dns_cache_async = async_variant("save_dns_cache")
+    load_dns_cache_async = async_variant("load_dns_cache")
+    get_most_visited_urls_async = async_variant("get_most_visited_urls")
+    get_cookie_allowlist_async = async_variant("get_cookie_allowlist")
+    allow_cookies_for_site_async = async_variant("allow_cookies_for_site")
+    disallow_cookies_for_site_async = async_variant("disallow_cookies_for_site")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Browser database maintenance")
+    parser.add_argument("--rebuild-search-index", action="store_true",
+                        help="re-index all history and bookmarks for search")
+    args = parser.parse_args()
+
+    db = Database()
+    if args.rebuild_search_index:
+        db.rebuild_search_index()
+        print("Search index rebuilt")
+    db.close()
@@ -0,0 +1,225 @@
+import base64
+import hmac
+import ipaddress
+import secrets
+import selectors
+import socket
+import socketserver
+import threading
+
+# Largest request head (request line and headers) accepted from the browser
+MAX_HEADER_SIZE = 64 * 1024
+# Bytes moved per read while relaying
+RELAY_CHUNK_SIZE = 64 * 1024
+# Seconds to wait for the browser's request and for the upstream connection
+REQUEST_TIMEOUT = 10
+CONNECT_TIMEOUT = 10
+# Headers meant for the proxy rather than the origin server
+HOP_BY_HOP_HEADERS = ("proxy-connection", "proxy-authorization", "connection", "keep-alive")
+LOCAL_HOSTNAMES = ("localhost",)
+# User name of the per-launch proxy credential; the password is random
+PROXY_USER = "browser"
+
+def split_host_port(authority, default_port):
+    """("host", port) from "host:port", "[v6]:port" or a bare host"""
+    if authority.startswith("["):
+        host, _, rest = authority[1:].partition("]")
+        port = rest[1:] if rest.startswith(":") else ""
+    elif authority.count(":") == 1:
+        host, _, port = authority.partition(":")
+    else:
+        host, port = authority, ""
+    return host.lower(), int(port) if port else default_port
+
+def is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+class ProxyHandler(socketserver.BaseRequestHandler):
+    """One browser connection: resolve the target with DoH, connect, relay"""
+
+    def handle(self):
+        proxy = self.server.proxy
+        self.request.settimeout(REQUEST_TIMEOUT)
+        try:
+            head, rest = self.read_head()
+        except (OSError, ValueError):
+            return
+        lines = head.split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            self.reply(400, "Bad Request")
+            return
+        if not proxy.authorized(lines[1:]):
+            self.reply(407, "Proxy Authentication Required",
+                       f'Proxy-Authenticate: Basic realm="{PROXY_USER}"\r\n')
+            return
+
+        if method.upper() == "CONNECT":
+            host, port = split_host_port(target, 443)
+            forward = rest
+        elif target.lower().startswith("http://"):
+            authority, _, path = target[7:].partition("/")
+            host, port = split_host_port(authority, 80)
+            # Origin servers expect a path, and one request per connection
+            # keeps every request going to the host it names
+            headers = [line for line in lines[1:]
+                       if line.split(":", 1)[0].strip().lower() not in HOP_BY_HOP_HEADERS]
+            head = "\r\n".join([f"{method} /{path} {version}"] + headers + ["Connection: close"])
+            forward = head.encode("latin-1") + b"\r\n\r\n" + rest
+        else:
+            self.reply(400, "Bad Request")
+            return
+
+        upstream = proxy.connect(host, port)
+        if upstream is None:
+            self.reply(502, "Bad Gateway")
+            return
+        with upstream:
+            if method.upper() == "CONNECT":
+                self.request.sendall(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+            if forward:
+                upstream.sendall(forward)
+            self.relay(self.request, upstream)
+
+    def read_head(self):
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = self.request.recv(RELAY_CHUNK_SIZE)
+            if not chunk:
+                raise ValueError("connection closed before the request was complete")
+            data += chunk
+            if len(data) > MAX_HEADER_SIZE:
+                raise ValueError("request head too large")
+        head, _, rest = data.partition(b"\r\n\r\n")
+        return head.decode("latin-1"), rest
+
+    def reply(self, status, reason, headers=""):
+        try:
+            self.request.sendall(f"HTTP/1.1 {status} {reason}\r\n{headers}Content-Length: 0\r\n"
+                                 f"Connection: close\r\n\r\n".encode("ascii"))
+        except OSError:
+            pass
+
+    def relay(self, client, upstream):
+        """Copy bytes both ways until either side closes"""
+        client.settimeout(None)
+        upstream.settimeout(None)
+        peers = {client: upstream, upstream: client}
+        with selectors.DefaultSelector() as selector:
+            selector.register(client, selectors.EVENT_READ)
+            selector.register(upstream, selectors.EVENT_READ)
+            while True:
+                for key, _ in selector.select():
+                    try:
+                        data = key.fileobj.recv(RELAY_CHUNK_SIZE)
+                        if not data:
+                            return
+                        peers[key.fileobj].sendall(data)
+                    except OSError:
+                        return
+
+class ProxyServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class DNSProxy:
+    """Local HTTP proxy that makes the web engine use the secure resolver
+
+    With an application proxy set, Chromium leaves name resolution to the
+    proxy, so every host is looked up once, over DoH, through the resolver's
+    cache and in-flight coalescing, and connected to by the address that
+    lookup returned. HTTPS is tunnelled with CONNECT and stays end-to-end
+    encrypted; plain HTTP requests are forwarded one per connection.
+
+    Only clients presenting this launch's random Basic credential, which
+    the browser hands to the web engine, are served, so other local
+    processes cannot tunnel through it. Every byte of every page passes
+    through the Python relay threads, and there is no fallback to system
+    DNS: if no DoH upstream is reachable, pages fail to load.
+    """
+
+    def __init__(self, resolver, host="127.0.0.1", port=0):
+        self.resolver = resolver
+        self.server = ProxyServer((host, port), ProxyHandler)
+        self.server.proxy = self
+        self.thread = None
+        self.username = PROXY_USER
+        self.password = secrets.token_urlsafe(32)
+        token = base64.b64encode(f"{self.username}:{self.password}".encode("ascii"))
+        self.credential = b"Basic " + token
+        self.lock = threading.Lock()
+        self.unauthorized = 0
+        self.connections = 0
+        self.resolve_failures = 0
+        self.connect_failures = 0
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name="dns-proxy", daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        if self.thread is not None:
+            self.server.shutdown()
+            self.thread = None
+        self.server.server_close()
+
+    def authorized(self, header_lines):
+        """Whether the request head carries this launch's credential"""
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "proxy-authorization":
+                if hmac.compare_digest(value.strip().encode("latin-1"), self.credential):
+                    return True
+        with self.lock:
+            self.unauthorized += 1
+        return False
+
+    def addresses(self, host):
+        """Addresses to try for host, preferred first; IP literals pass through"""
+        if is_ip_address(host):
+            return [host]
+        if host in LOCAL_HOSTNAMES:
+            return ["127.0.0.1", "::1"]
+        try:
+            if self.resolver.resolve(host) is None:
+                return []
+        except RuntimeError:
+            # The resolver has shut down while a relay was still open
+            return []
+        return self.resolver.cached_addresses(host)
+
+    def connect(self, host, port):
+        """A socket connected to host, or None if it cannot be resolved or reached"""
+        with self.lock:
+            self.connections += 1
+        addresses = self.addresses(host)
+        if not addresses:
+            with self.lock:
+                self.resolve_failures += 1
+            print(f"Error resolving {host} for the proxy")
+            return None
+        for address in addresses:
+            try:
+                return socket.create_connection((address, port), timeout=CONNECT_TIMEOUT)
+            except OSError as e:
+                error = e
+        with self.lock:
+            self.connect_failures += 1
+        print(f"Error connecting to {host}:{port}: {error}")
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {"connections": self.connections, "resolve_failures": self.resolve_failures,
+                    "connect_failures": self.connect_failures,
+                    "unauthorized": self.unauthorized}
@@ -1,47 +1,538 @@
-import dns.resolver
+import base64
+import dns.message
+import dns.rcode
+import dns.rdatatype
 import requests
-import json
-from PyQt5.QtCore import QObject, pyqtSignal
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+# DNS-over-HTTPS servers (RFC 8484); queries go to the fastest first
+DOH_UPSTREAMS = (
+    "https://cloudflare-dns.com/dns-query",
+    "https://dns.google/dns-query",
+    "https://dns.quad9.net/dns-query",
+)
+DOH_CONTENT_TYPE = "application/dns-message"
+# Queries whose GET URL would be longer than this are POSTed instead
+MAX_GET_QUERY_LENGTH = 512
+# Record types looked up for every name, preferred first
+ADDRESS_TYPES = (dns.rdatatype.A, dns.rdatatype.AAAA)
+
+# Cached answers live for their record TTL, clamped to these bounds (seconds)
+MIN_TTL = 30
+MAX_TTL = 24 * 3600
+# Bounds for caching "no such host" answers, whose lifetime comes from the
+# SOA record in the authority section (RFC 2308); NEGATIVE_TTL is used when
+# the server sends no SOA
+MIN_NEGATIVE_TTL = 10
+MAX_NEGATIVE_TTL = 3600
+NEGATIVE_TTL = 300
+# Expired answers are still served, while a fresh lookup runs in the
+# background, for up to this long past their expiry (seconds)
+MAX_STALE = 24 * 3600
+# Cached names kept; the least recently used are dropped beyond this
+MAX_CACHE_ENTRIES = 10000
+# Milliseconds between saves of the cache to the database
+CACHE_SAVE_INTERVAL = 5 * 60 * 1000
+
+# Prefetching: lookups running at once (leaving resolver threads free for
+# navigation), lookups started per second with bursts of up to
+# PREFETCH_BURST, and hosts waiting beyond which new ones are dropped
+PREFETCH_CONCURRENCY = 4
+PREFETCH_RATE = 10
+PREFETCH_BURST = 20
+PREFETCH_QUEUE_LIMIT = 200
+# Hosts remembered as prefetched, for the warm navigation metric
+PREFETCHED_HOSTS_LIMIT = 5000
+# Most visited history URLs whose hosts are prefetched at startup
+PREFETCH_TOP_URLS = 200
+# Distinct link hosts taken from a loaded page, in document order
+PREFETCH_PAGE_LINKS = 50
+# Run in an isolated world after a page loads, so it works with the page's
+# JavaScript disabled and cannot be seen or changed by the page
+LINK_HOSTS_SCRIPT = f"""
+(function () {{
+    var hosts = [];
+    var seen = {{}};
+    for (var i = 0; i < document.links.length && hosts.length < {PREFETCH_PAGE_LINKS}; i++) {{
+        var link = document.links[i];
+        if ((link.protocol === "https:" || link.protocol === "http:") && !seen[link.hostname]) {{
+            seen[link.hostname] = true;
+            hosts.push(link.hostname);
+        }}
+    }}
+    return hosts;
+}})()
+"""
+# Lookups running at once, and seconds to wait for a DoH server's answer
+RESOLVER_THREADS = 8
+QUERY_TIMEOUT = 5
+# HTTP requests in flight at once across all lookups
+QUERY_THREADS = 16
+
+# Upstream latency is an exponentially weighted moving average; a failed
+# query counts as taking the full timeout
+LATENCY_SMOOTHING = 0.3
+INITIAL_LATENCY = 0.1
+# A query slower than twice its server's usual latency is hedged by asking
+# the next fastest server too, within these bounds (seconds)
+MIN_HEDGE_DELAY = 0.05
+MAX_HEDGE_DELAY = 1.0
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+def negative_ttl(response):
+    """Lifetime of a negative answer: the SOA's TTL capped by its MINIMUM field"""
+    for rrset in response.authority:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            minimum = min(rrset.ttl, rrset[0].minimum)
+            return clamp(minimum, MIN_NEGATIVE_TTL, MAX_NEGATIVE_TTL)
+    return NEGATIVE_TTL
+
+def parse_answer(response, rdtype):
+    """(addresses, ttl) from a wire-format response, or None if it is unusable
+
+    The answer may lead through CNAMEs; it lives as long as the shortest
+    TTL along the chain. NXDOMAIN and empty answers give no addresses and
+    the negative TTL; server failures give None so another server is asked.
+    """
+    rcode = response.rcode()
+    if rcode == dns.rcode.NXDOMAIN:
+        return [], negative_ttl(response)
+    if rcode != dns.rcode.NOERROR:
+        return None
+    addresses = [rdata.address for rrset in response.answer
+                 if rrset.rdtype == rdtype for rdata in rrset]
+    if not addresses:
+        return [], negative_ttl(response)
+    ttl = min(rrset.ttl for rrset in response.answer)
+    return addresses, clamp(ttl, MIN_TTL, MAX_TTL)
+
+class DNSCache:
+    """Answers keyed by (hostname, record type), least recently used first
+
+    A cached value is a tuple of addresses; an empty tuple records that the
+    name has no such records, so repeated lookups of dead hosts are cheap too.
+    Expiry times are wall-clock epochs so entries can be saved and reloaded
+    across restarts. Entries past their expiry are still returned, flagged
+    stale, until max_stale seconds later.
+    """
+
+    def __init__(self, max_entries=MAX_CACHE_ENTRIES, max_stale=MAX_STALE):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.max_stale = max_stale
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, hostname, rtype):
+        """(addresses, stale) from the cache, or None when the name must be looked up"""
+        key = (hostname, rtype)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] + self.max_stale <= now:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            expires, addresses = entry
+            stale = expires <= now
+            if stale:
+                self.stale_hits += 1
+            elif addresses:
+                self.hits += 1
+            else:
+                self.negative_hits += 1
+            return addresses, stale
+
+    def put(self, hostname, rtype, addresses, ttl):
+        self.store([(hostname, rtype, tuple(addresses), time.time() + ttl)])
+
+    def store(self, rows):
+        """Add (hostname, rtype, addresses, expires) rows as most recently used"""
+        with self.lock:
+            for hostname, rtype, addresses, expires in rows:
+                key = (hostname, rtype)
+                self.entries[key] = (expires, tuple(addresses))
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def load(self, rows):
+        """Add rows saved by an earlier run, keeping newer answers already cached"""
+        with self.lock:
+            known = set(self.entries)
+        self.store(row for row in rows if (row[0], row[1]) not in known)
+        # Answers cached meanwhile are the most recently used
+        with self.lock:
+            for key in known:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+
+    def snapshot(self):
+        """(hostname, rtype, addresses, expires) rows, least recently used first"""
+        cutoff = time.time() - self.max_stale
+        with self.lock:
+            return [(hostname, rtype, addresses, expires)
+                    for (hostname, rtype), (expires, addresses) in self.entries.items()
+                    if expires > cutoff]
+
+    def addresses(self, hostname):
+        """All usable cached addresses of hostname, A records first; not counted in stats"""
+        cutoff = time.time() - self.max_stale
+        found = []
+        with self.lock:
+            for rtype in ADDRESS_TYPES:
+                entry = self.entries.get((hostname, rtype))
+                if entry is not None and entry[0] > cutoff:
+                    found.extend(entry[1])
+        return found
+
+    def is_fresh(self, hostname):
+        """Whether an unexpired answer for hostname is cached; not counted in stats"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get((hostname, ADDRESS_TYPES[0]))
+            return entry is not None and entry[0] > now
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits,
+                    "stale_hits": self.stale_hits, "negative_hits": self.negative_hits,
+                    "misses": self.misses}
 
 class SecureDNSResolver(QObject):
+    """DNS-over-HTTPS lookups on a small thread pool
+
+    resolve_async() never blocks: answers come from the cache or from a
+    worker thread, and concurrent requests for the same name share one
+    lookup. A lookup asks for A and AAAA records at the same time, in
+    RFC 8484 wire format, from the upstream with the lowest measured
+    latency, and hedges with the next one when that server is slow or
+    fails. Every address found is also announced through
+    resolution_complete, which Qt delivers on the GUI thread.
+    """
     resolution_complete = pyqtSignal(str, str)
-    
-    def __init__(self):
+
+    def __init__(self, upstreams=DOH_UPSTREAMS):
         super().__init__()
-        # Use Cloudflare's DNS-over-HTTPS service by default
-        self.doh_url = "https://cloudflare-dns.com/dns-query"
-        self.session = requests.Session()
-        self.session.headers.update({
-            'accept': 'application/dns-json'
-        })
+        self.upstreams = list(upstreams)
+        self.latency = {upstream: INITIAL_LATENCY for upstream in self.upstreams}
+        self.timeout = QUERY_TIMEOUT
+        # requests sessions are not thread-safe; each worker gets its own
+        self.local = threading.local()
+        self.cache = DNSCache()
+        # Lookups wait on queries, so the two must not share a pool
+        self.executor = ThreadPoolExecutor(max_workers=RESOLVER_THREADS,
+                                           thread_name_prefix="dns")
+        self.query_executor = ThreadPoolExecutor(max_workers=QUERY_THREADS,
+                                                 thread_name_prefix="doh")
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    @property
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+            session.headers.update({
+                'accept': DOH_CONTENT_TYPE
+            })
+        return session
 
     def resolve(self, hostname):
-        """Resolve hostname using DNS-over-HTTPS"""
+        """Resolve hostname using DNS-over-HTTPS, waiting for the answer
+
+        Blocks for up to the query timeout on a cache miss, so the GUI
+        thread should use resolve_async() instead.
+        """
+        return self.resolve_async(hostname).result()
+
+    def cached_addresses(self, hostname):
+        return self.cache.addresses(hostname.lower().rstrip("."))
+
+    def cached_address(self, hostname):
+        """(found, address, stale) from the cache; found is False if a lookup is needed"""
+        found = True
+        stale = False
+        address = None
+        for rtype in ADDRESS_TYPES:
+            cached = self.cache.get(hostname, rtype)
+            if cached is None:
+                found = False
+                continue
+            addresses, expired = cached
+            stale = stale or expired
+            if addresses and address is None:
+                address = addresses[0]
+        return found, address, stale
+
+    def resolve_async(self, hostname):
+        """Start resolving hostname; returns a Future for its preferred address or None
+
+        A stale cached answer is returned at once and refreshed in the
+        background.
+        """
+        hostname = hostname.lower().rstrip(".")
+        found, address, stale = self.cached_address(hostname)
+        if found:
+            future = Future()
+            future.set_result(address)
+            if address:
+                self.resolution_complete.emit(hostname, address)
+            if stale:
+                self.start_lookup(hostname)
+            return future
+        return self.start_lookup(hostname)
+
+    def start_lookup(self, hostname):
+        with self.lock:
+            future = self.in_flight.get(hostname)
+            if future is None:
+                future = self.executor.submit(self.lookup, hostname)
+                self.in_flight[hostname] = future
+                future.add_done_callback(lambda f: self.finish(hostname, f))
+        return future
+
+    def finish(self, hostname, future):
+        with self.lock:
+            if self.in_flight.get(hostname) is future:
+                del self.in_flight[hostname]
+
+    def lookup(self, hostname):
+        """Resolve A and AAAA records and cache them; runs on a worker thread"""
         try:
-            params = {
-                'name': hostname,
-                'type': 'A',
-                'do': 'true',  # DNSSEC OK
-                'cd': 'false'  # Checking Disabled = false (enable DNSSEC validation)
-            }
-            
-            response = self.session.get(self.doh_url, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('Answer'):
-                    ip = data['Answer'][0]['data']
-                    self.resolution_complete.emit(hostname, ip)
-                    return ip
-            return None
+            answers = self.race(hostname, ADDRESS_TYPES)
         except Exception as e:
             print(f"DNS resolution error: {e}")
             return None
+        address = None
+        for rtype in ADDRESS_TYPES:
+            if rtype not in answers:
+                continue
+            addresses, ttl = answers[rtype]
+            self.cache.put(hostname, rtype, addresses, ttl)
+            if addresses and address is None:
+                address = addresses[0]
+        if address:
+            self.resolution_complete.emit(hostname, address)
+        return address
+
+    def ranked_upstreams(self):
+        with self.lock:
+            return sorted(self.upstreams, key=self.latency.__getitem__)
+
+    def hedge_delay(self, upstream):
+        with self.lock:
+            return clamp(2 * self.latency[upstream], MIN_HEDGE_DELAY, MAX_HEDGE_DELAY)
+
+    def record_latency(self, upstream, seconds):
+        with self.lock:
+            self.latency[upstream] += LATENCY_SMOOTHING * (seconds - self.latency[upstream])
+
+    def race(self, hostname, rtypes):
+        """Ask upstreams for each record type until one gives a valid answer
+
+        Each type starts with the fastest upstream. The next one is asked
+        too whenever the last one asked fails or takes longer than its hedge
+        delay; the first valid answer wins and slower ones are ignored.
+        Returns {rtype: (addresses, ttl)} for the types that were answered.
+        """
+        upstreams = self.ranked_upstreams()
+        deadline = time.monotonic() + self.timeout
+        answers = {}
+        pending = {}
+        asked = dict.fromkeys(rtypes, 0)
+        next_hedge = {}
+
+        def ask_next(rtype):
+            if asked[rtype] == len(upstreams):
+                next_hedge[rtype] = deadline
+                return
+            upstream = upstreams[asked[rtype]]
+            asked[rtype] += 1
+            future = self.query_executor.submit(self.query, upstream, hostname, rtype)
+            pending[future] = rtype
+            next_hedge[rtype] = time.monotonic() + self.hedge_delay(upstream)
+
+        for rtype in rtypes:
+            ask_next(rtype)
+        while pending and len(answers) < len(rtypes):
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake = min(next_hedge[rtype] for rtype in rtypes if rtype not in answers)
+            done, _ = wait(list(pending), timeout=max(0, min(wake, deadline) - now),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                rtype = pending.pop(future)
+                if rtype in answers:
+                    continue
+                answer = future.result()
+                if answer is not None:
+                    answers[rtype] = answer
+                else:
+                    # A failed server will not answer; move on right away
+                    ask_next(rtype)
+            now = time.monotonic()
+            for rtype in rtypes:
+                if rtype not in answers and next_hedge[rtype] <= now < deadline:
+                    ask_next(rtype)
+        return answers
 
-    def verify_dnssec(self, response):
-        """Verify DNSSEC signatures if present"""
+    def query(self, upstream, hostname, rtype):
+        """One wire-format DoH request; (addresses, ttl), or None on failure"""
+        request = dns.message.make_query(hostname, rtype, want_dnssec=True)
+        # RFC 8484 asks for ID 0 so identical queries can be HTTP-cached
+        request.id = 0
+        wire = request.to_wire()
+        started = time.monotonic()
         try:
-            if response.get('AD', False):  # AD = Authenticated Data
-                return True
-            return False
-        except Exception:
-            return False
+            encoded = base64.urlsafe_b64encode(wire).rstrip(b"=").decode("ascii")
+            if len(encoded) <= MAX_GET_QUERY_LENGTH:
+                response = self.session.get(upstream, params={'dns': encoded},
+                                            timeout=self.timeout)
+            else:
+                response = self.session.post(upstream, data=wire, timeout=self.timeout,
+                                             headers={'content-type': DOH_CONTENT_TYPE})
+            response.raise_for_status()
+            message = dns.message.from_wire(response.content)
+            if not message.question or message.question[0].name != request.question[0].name:
+                raise ValueError("answer does not match the query")
+            answer = parse_answer(message, rtype)
+        except Exception as e:
+            print(f"DNS query to {upstream} failed: {e}")
+            answer = None
+        self.record_latency(upstream, time.monotonic() - started if answer else self.timeout)
+        return answer
+
+    def shutdown(self):
+        """Stop the worker threads without waiting for queued lookups"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.query_executor.shutdown(wait=False, cancel_futures=True)
+
+def url_host(url):
+    """Lowercase host of an http(s) URL, or None"""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return None
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return None
+    return parts.hostname
+
+class DNSPrefetcher(QObject):
+    """Warms the resolver cache for hosts the user is likely to visit next
+
+    Hosts are queued, skipped if already fresh in the cache, and looked up
+    at most PREFETCH_CONCURRENCY at a time and PREFETCH_RATE per second
+    (a token bucket), so a page full of links cannot flood the upstreams.
+    record_navigation() counts how many navigations found their host warm.
+    """
+    lookup_done = pyqtSignal()
+
+    def __init__(self, resolver, parent=None):
+        super().__init__(parent)
+        self.resolver = resolver
+        self.queue = deque()
+        self.queued = set()
+        self.prefetched = set()
+        self.active = 0
+        self.tokens = PREFETCH_BURST
+        self.refilled = time.monotonic()
+        self.pump_timer = QTimer(self)
+        self.pump_timer.setSingleShot(True)
+        self.pump_timer.timeout.connect(self.pump)
+        # Lookups finish on resolver threads; continue on this object's thread
+        self.lookup_done.connect(self.on_lookup_done)
+        self.requested = 0
+        self.dropped = 0
+        self.lookups = 0
+        self.navigations = 0
+        self.warm_navigations = 0
+        self.prefetched_navigations = 0
+
+    def prefetch(self, hostnames):
+        """Queue hostnames for lookup, most likely to be visited first"""
+        for hostname in hostnames:
+            if not hostname:
+                continue
+            hostname = hostname.lower().rstrip(".")
+            self.requested += 1
+            if hostname in self.queued or self.resolver.cache.is_fresh(hostname):
+                continue
+            if len(self.queue) >= PREFETCH_QUEUE_LIMIT:
+                self.dropped += 1
+                continue
+            self.queue.append(hostname)
+            self.queued.add(hostname)
+        self.pump()
+
+    def prefetch_urls(self, urls):
+        self.prefetch(url_host(url) for url in urls)
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(PREFETCH_BURST, self.tokens + (now - self.refilled) * PREFETCH_RATE)
+        self.refilled = now
+
+    def pump(self):
+        """Start queued lookups as far as the concurrency and rate limits allow"""
+        self.refill()
+        while self.queue and self.active < PREFETCH_CONCURRENCY:
+            if self.tokens < 1:
+                wait_ms = int((1 - self.tokens) / PREFETCH_RATE * 1000) + 1
+                self.pump_timer.start(wait_ms)
+                return
+            hostname = self.queue.popleft()
+            self.queued.discard(hostname)
+            if self.resolver.cache.is_fresh(hostname):
+                continue
+            self.tokens -= 1
+            self.active += 1
+            self.lookups += 1
+            if len(self.prefetched) >= PREFETCHED_HOSTS_LIMIT:
+                self.prefetched.clear()
+            self.prefetched.add(hostname)
+            try:
+                future = self.resolver.start_lookup(hostname)
+            except RuntimeError:
+                # The resolver has been shut down
+                self.queue.clear()
+                self.queued.clear()
+                return
+            future.add_done_callback(lambda f: self.lookup_done.emit())
+
+    def on_lookup_done(self):
+        self.active -= 1
+        self.pump()
+
+    def record_navigation(self, hostname):
+        """Count a navigation and whether its host was already resolved"""
+        hostname = hostname.lower().rstrip(".")
+        self.navigations += 1
+        if self.resolver.cache.is_fresh(hostname):
+            self.warm_navigations += 1
+            if hostname in self.prefetched:
+                self.prefetched_navigations += 1
+
+    def stats(self):
+        return {"requested": self.requested, "dropped": self.dropped,
+                "lookups": self.lookups, "queued": len(self.queue),
+                "navigations": self.navigations, "warm_navigations": self.warm_navigations,
+                "prefetched_navigations": self.prefetched_navigations}
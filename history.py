@@ -1,9 +1,117 @@
-from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QTableWidget, 
-                           QPushButton, QTableWidgetItem, QHBoxLayout)
-from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QTableView,
+                           QPushButton, QHBoxLayout, QLineEdit)
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer
 from themes import apply_theme
-import json
-from datetime import datetime
+from database import format_epoch, HISTORY_PAGE_SIZE
+
+class HistoryModel(QAbstractTableModel):
+    """History rows fetched page by page as the view scrolls
+
+    Only (visit_id, visit_time, title, url) tuples for rows already scrolled
+    past are held; dates are formatted when a cell is painted. While a search
+    is active the rows are the ranked matches instead and nothing is paged.
+    """
+    HEADERS = ["Title", "URL", "Date"]
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.rows = []
+        self.loading = False
+        self.exhausted = db is None
+        self.search_text = ""
+        # Bumped on every new search and on clear, so late pages and results
+        # requested before then are dropped
+        self.generation = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        visit_id, visit_time, title, url = self.rows[index.row()]
+        column = index.column()
+        if column == 0:
+            return title
+        if column == 1:
+            return url
+        return format_epoch(visit_time)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self.loading = True
+        before = None
+        if self.rows:
+            visit_id, visit_time = self.rows[-1][:2]
+            before = (visit_time, visit_id)
+        generation = self.generation
+        self.db.get_history_page_async(before, HISTORY_PAGE_SIZE,
+                                       callback=lambda page: self.append_page(page, generation),
+                                       errback=lambda error: self.page_failed(generation))
+
+    def page_failed(self, generation):
+        # Let the next scroll try again rather than waiting forever
+        if generation == self.generation:
+            self.loading = False
+
+    def append_page(self, page, generation):
+        if generation != self.generation:
+            return
+        self.loading = False
+        if len(page) < HISTORY_PAGE_SIZE:
+            self.exhausted = True
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.endInsertRows()
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self.rows = rows
+        self.endResetModel()
+
+    def search(self, text):
+        """Show ranked matches for text, or go back to paging when it is empty"""
+        text = text.strip()
+        if text == self.search_text or self.db is None:
+            return
+        self.search_text = text
+        self.generation += 1
+        generation = self.generation
+        self.loading = False
+        if not text:
+            self.exhausted = False
+            self.set_rows([])
+            self.fetchMore()
+            return
+        self.exhausted = True
+
+        def show_results(rows):
+            if generation == self.generation:
+                self.set_rows(rows)
+
+        self.db.search_history_async(text, callback=show_results)
+
+    def clear(self):
+        self.generation += 1
+        self.beginResetModel()
+        self.rows = []
+        self.loading = False
+        self.exhausted = True
+        self.endResetModel()
 
 class History(QDialog):
     def __init__(self, parent=None):
@@ -12,44 +120,57 @@ class History(QDialog):
         self.db = parent.db if parent else None
         self.setWindowTitle("Browsing History")
         self.setFixedSize(600, 400)
-        
+
         if parent and hasattr(parent, 'settings'):
             apply_theme(self, parent.settings.get('theme', 'dracula'))
-        
+
         layout = QVBoxLayout(self)
-        
-        # Create history table
-        self.table = QTableWidget()
-        self.table.setColumnCount(3)
-        self.table.setHorizontalHeaderLabels(["Title", "URL", "Date"])
+
+        # Search box; queries run once typing pauses
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search history")
+        self.search_input.setClearButtonEnabled(True)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.run_search)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        layout.addWidget(self.search_input)
+
+        # History view; the model pulls pages from the database as it scrolls
+        self.model = HistoryModel(self.db, self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QTableView.SelectRows)
+        self.table.verticalHeader().setVisible(False)
         self.table.horizontalHeader().setStretchLastSection(True)
         layout.addWidget(self.table)
-        
+
         # Buttons
         button_layout = QHBoxLayout()
         clear_button = QPushButton("Clear History")
         clear_button.clicked.connect(self.clear_history)
         close_button = QPushButton("Close")
         close_button.clicked.connect(self.accept)
-        
+
         button_layout.addWidget(clear_button)
         button_layout.addWidget(close_button)
         layout.addLayout(button_layout)
-        
+
         self.load_history()
-        
+
     def load_history(self):
         if not self.db:
             return
-            
-        history = self.db.get_history()
-        self.table.setRowCount(len(history))
-        for i, entry in enumerate(history):
-            self.table.setItem(i, 0, QTableWidgetItem(entry["title"]))
-            self.table.setItem(i, 1, QTableWidgetItem(entry["url"]))
-            self.table.setItem(i, 2, QTableWidgetItem(entry["date"]))
-    
+        self.model.fetchMore()
+
+    def run_search(self):
+        self.model.search(self.search_input.text())
+
     def clear_history(self):
         if self.db:
-            self.db.clear_history()
-        self.table.setRowCount(0)
+            self.db.clear_history_async()
+        self.model.clear()
+        # Drop cleared pages and searches from address bar suggestions
+        if self.browser and hasattr(self.browser, 'omnibox'):
+            self.browser.omnibox.reload()
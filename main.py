@@ -1,14 +1,17 @@
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
-                          QWidget, QLineEdit, QPushButton, QMenu, QAction, QDialog,
+                          QWidget, QLineEdit, QPushButton, QMenu, QAction,
                           QTableWidgetItem, QStatusBar, QLabel, QToolBar, QToolButton, QInputDialog)
-from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEngineSettings, QWebEnginePage, QWebEngineProfile
-from PyQt5.QtCore import QUrl, QObject, pyqtSlot, QTimer, Qt, QMimeData
-from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor
+from PyQt5.QtWebEngineWidgets import (QWebEngineView, QWebEngineSettings, QWebEnginePage,
+                                      QWebEngineProfile, QWebEngineScript)
+from PyQt5.QtCore import QUrl, QObject, pyqtSlot, QTimer, Qt, QMimeData, QFileSystemWatcher
+from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor, QWebEngineUrlRequestInfo
 from PyQt5.QtGui import QDrag, QDragEnterEvent, QDropEvent
+from PyQt5.QtNetwork import QNetworkProxy
 import os
 import sys
-import json
-from settings import Settings
+import threading
+import time
+from settings import Settings, SettingsStore
 from about import About  
 from themes import THEMES, apply_theme
 from history import History
@@ -17,24 +20,119 @@ from datetime import datetime
 import tempfile
 from bookmarks import BookmarkManager
 from database import Database
-from dns_resolver import SecureDNSResolver
+from dns_resolver import (SecureDNSResolver, DNSPrefetcher, LINK_HOSTS_SCRIPT,
+                          PREFETCH_TOP_URLS, CACHE_SAVE_INTERVAL as DNS_CACHE_SAVE_INTERVAL)
+from dns_proxy import DNSProxy
+from omnibox import OmniboxCompleter
+from cookies import CookieFilter, CookieIndex
+from public_suffix import registrable_domain
+from adblock import (load_rules, load_cached_rules, FILTER_LIST_DIR,
+                     CACHE_FILE as ADBLOCK_CACHE_FILE)
 
 class AdBlocker(QWebEngineUrlRequestInterceptor):
+    # Map Qt's request types onto the filter list "$type" options
+    RESOURCE_TYPES = {
+        QWebEngineUrlRequestInfo.ResourceTypeMainFrame: "document",
+        QWebEngineUrlRequestInfo.ResourceTypeSubFrame: "subdocument",
+        QWebEngineUrlRequestInfo.ResourceTypeStylesheet: "stylesheet",
+        QWebEngineUrlRequestInfo.ResourceTypeScript: "script",
+        QWebEngineUrlRequestInfo.ResourceTypeImage: "image",
+        QWebEngineUrlRequestInfo.ResourceTypeFavicon: "image",
+        QWebEngineUrlRequestInfo.ResourceTypeFontResource: "font",
+        QWebEngineUrlRequestInfo.ResourceTypeObject: "object",
+        QWebEngineUrlRequestInfo.ResourceTypePluginResource: "object",
+        QWebEngineUrlRequestInfo.ResourceTypeMedia: "media",
+        QWebEngineUrlRequestInfo.ResourceTypeXhr: "xmlhttprequest",
+        QWebEngineUrlRequestInfo.ResourceTypePing: "ping",
+        QWebEngineUrlRequestInfo.ResourceTypeCspReport: "ping",
+    }
+
+    def __init__(self, cache_path=None, parent=None):
+        super().__init__(parent)
+        self.cache_path = cache_path
+        # A reload asked for while one runs is folded into a rerun; both flags
+        # change only under the lock so no request falls between them
+        self.reload_lock = threading.Lock()
+        self.reloading = False
+        self.reload_pending = False
+        # Start blocking straight from the (possibly stale) cache and rebuild
+        # in the background if the lists changed
+        self.rules = load_cached_rules(cache_path=cache_path)
+        if self.rules.stale:
+            self.reload()
+
+        # Pick up filter lists added or edited while the browser is running
+        self.reload_timer = QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(1000)
+        self.reload_timer.timeout.connect(self.reload)
+        self.watcher = QFileSystemWatcher(self)
+        if os.path.isdir(FILTER_LIST_DIR):
+            self.watcher.addPath(FILTER_LIST_DIR)
+        self.watcher.directoryChanged.connect(self.reload_timer.start)
+
     def interceptRequest(self, info):
-        url = info.requestUrl().toString()
-        # Basic ad blocking rules
-        blocked_domains = [
-            'ads', 'analytics', 'tracker', 'doubleclick.net',
-            'google-analytics.com', 'advertising'
-        ]
-        if any(domain in url.lower() for domain in blocked_domains):
+        # Read the snapshot once; a reload may swap self.rules at any time
+        rules = self.rules
+        request_url = info.requestUrl()
+        resource_type = self.RESOURCE_TYPES.get(info.resourceType(), "other")
+        if rules.should_block(request_url.toString(), request_url.host(),
+                              info.firstPartyUrl().host(), resource_type):
             info.block(True)
 
+    def reload(self):
+        """Recompile the filter lists on a background thread"""
+        with self.reload_lock:
+            if self.reloading:
+                self.reload_pending = True
+                return
+            self.reloading = True
+        threading.Thread(target=self.rebuild_rules, daemon=True).start()
+
+    def rebuild_rules(self):
+        while True:
+            with self.reload_lock:
+                self.reload_pending = False
+            try:
+                rules = load_rules(cache_path=self.cache_path)
+            except Exception as e:
+                print(f"Error loading filter lists: {e}")
+                rules = None
+            if rules is not None:
+                # Swapping the reference is atomic; requests in flight keep
+                # using the snapshot they already read
+                self.rules = rules
+            with self.reload_lock:
+                if not self.reload_pending:
+                    self.reloading = False
+                    return
+
+# Drag payload for bookmarks moved within the browser; the URL also goes in
+# as text so drops on other applications still work
+BOOKMARK_MIME_TYPE = "application/x-secure-browser-bookmark-id"
+
+def bookmark_mime_data(bookmark_id, url):
+    mime = QMimeData()
+    mime.setText(url)
+    mime.setData(BOOKMARK_MIME_TYPE, str(bookmark_id).encode())
+    return mime
+
+def dropped_bookmark_id(mime):
+    """Id of the bookmark being dragged, or None for any other drag"""
+    if not mime.hasFormat(BOOKMARK_MIME_TYPE):
+        return None
+    try:
+        return int(bytes(mime.data(BOOKMARK_MIME_TYPE)).decode())
+    except ValueError:
+        return None
+
 class BookmarkButton(QToolButton):
-    def __init__(self, title, url, parent=None):
+    def __init__(self, title, url, parent=None, bookmark_id=None, folder_id=None):
         super().__init__(parent)
         self.setText(title)
         self.url = url
+        self.bookmark_id = bookmark_id
+        self.folder_id = folder_id
         self.setToolButtonStyle(Qt.ToolButtonTextOnly)
         self.setContextMenuPolicy(Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self.show_context_menu)
@@ -64,12 +162,9 @@ class BookmarkButton(QToolButton):
             return
 
         drag = QDrag(self)
-        mime = QMimeData()
-        mime.setText(self.url)
-        mime.setProperty('title', self.text())
-        drag.setMimeData(mime)
-        
-        result = drag.exec_(Qt.MoveAction)
+        drag.setMimeData(bookmark_mime_data(self.bookmark_id, self.url))
+        # The drop target moves the bookmark in the database
+        drag.exec_(Qt.MoveAction)
         self.drag_start_position = None  # Clear position after drag
         
     def mouseReleaseEvent(self, e):
@@ -85,121 +180,89 @@ class BookmarkButton(QToolButton):
         if action == delete_action:
             self.delete_bookmark()
         elif action == edit_action:
-            if self.browser:
-                dialog = BookmarkManager(self.browser)
-                dialog.title_input.setText(self.text())
-                dialog.url_input.setText(self.url)
-                if dialog.exec_():
-                    new_title = dialog.title_input.text()
-                    new_url = dialog.url_input.text()
-                    folder = dialog.folder_combo.currentText()
-                    # Delete old bookmark
-                    self.browser.db.delete_bookmark(self.text(), self.url)
-                    # Add new bookmark
-                    self.browser.db.add_bookmark(new_title, new_url, folder if folder != "No Folder" else None)
-                    # Update bookmark bar
-                    self.browser.update_bookmark_bar()
+            self.edit_bookmark()
             
     def delete_bookmark(self):
         try:
             if self.browser and self.browser.db:
-                self.browser.db.delete_bookmark(self.text(), self.url)
+                self.browser.db.delete_bookmark_async(self.bookmark_id)
                 self.browser.update_bookmark_bar()
         except Exception as e:
             print(f"Error deleting bookmark: {e}")
             
     def edit_bookmark(self):
-        dialog = BookmarkManager(self.parent())
-        dialog.title_input.setText(self.text())
-        dialog.url_input.setText(self.url)
+        if not self.browser:
+            return
+        dialog = BookmarkManager(self.browser)
+        # Saving in the dialog updates this bookmark by id
+        dialog.start_editing(self.bookmark_id, self.text(), self.url, self.folder_id)
         dialog.exec_()
 
 class FolderButton(QToolButton):
-    def __init__(self, name, parent=None):
+    def __init__(self, name, parent=None, folder_id=None):
         super().__init__(parent)
         self.setText(name)
         self.setAcceptDrops(True)
         self.folder_name = name
+        self.folder_id = folder_id
+        self.browser = parent
         self.setPopupMode(QToolButton.InstantPopup)
         self.setContextMenuPolicy(Qt.CustomContextMenu)
 
     def dragEnterEvent(self, event: QDragEnterEvent):
-        if event.mimeData().hasText():
+        if dropped_bookmark_id(event.mimeData()) is not None:
             event.acceptProposedAction()
 
     def dropEvent(self, event: QDropEvent):
-        url = event.mimeData().text()
-        title = event.source().text()
-        
-        try:
-            with open("browser_bookmarks.json", "r") as f:
-                bookmarks = json.load(f)
-            
-            # Find and update the bookmark's folder
-            for bookmark in bookmarks["bookmarks"]:
-                if bookmark["url"] == url and bookmark["title"] == title:
-                    bookmark["folder"] = self.folder_name
-                    break
-                    
-            with open("browser_bookmarks.json", "w") as f:
-                json.dump(bookmarks, f)
-                
-            # Update the bookmark bar
-            if self.parent():
-                self.parent().parent().update_bookmark_bar()
-                
-        except Exception as e:
-            print(f"Error moving bookmark: {e}")
+        bookmark_id = dropped_bookmark_id(event.mimeData())
+        if bookmark_id is None or not self.browser:
+            return
+        # Appended to the end of this folder
+        self.browser.db.move_bookmark_async(bookmark_id, self.folder_id)
+        self.browser.update_bookmark_bar()
+        event.acceptProposedAction()
 
 class DraggableAction(QAction):
-    def __init__(self, title, url, parent=None):
+    def __init__(self, title, url, parent=None, bookmark_id=None):
         super().__init__(title, parent)
         self.title = title
         self.url = url
-        self.setData({"title": title, "url": url})  # Store data for drag
+        self.bookmark_id = bookmark_id
+        self.setData({"title": title, "url": url, "id": bookmark_id})  # Store data for drag
 
 class FolderMenu(QMenu):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, bar=None, folder_id=None):
         super().__init__(parent)
         self.setAcceptDrops(True)
         self.drag_start_position = None
         self.drag_action = None
+        # Actions are created when the menu is about to show, and again only
+        # after the folder's contents have changed
+        self.bar = bar
+        self.folder_id = folder_id
+        self.shown_bookmarks = None
+        if bar is not None:
+            self.aboutToShow.connect(self.populate)
+
+    def populate(self):
+        bookmarks = self.bar.folder_bookmarks.get(self.folder_id, [])
+        if bookmarks is self.shown_bookmarks:
+            return
+        self.clear()
+        for bookmark in bookmarks:
+            self.addAction(self.bar.create_action(bookmark, self))
+        self.shown_bookmarks = bookmarks
 
     def mousePressEvent(self, e):
         action = self.actionAt(e.pos())
         if isinstance(action, DraggableAction) and e.button() == Qt.LeftButton:
-            drag = QDrag(self)
-            mime = QMimeData()
-            mime.setText(action.url)
-            mime.setProperty('title', action.title)
-            drag.setMimeData(mime)
-            
-            # Start drag operation
-            if drag.exec_(Qt.MoveAction) == Qt.MoveAction:
-                try:
-                    with open("browser_bookmarks.json", "r") as f:
-                        bookmarks = json.load(f)
-                    
-                    # Find and update the bookmark's folder
-                    for bookmark in bookmarks["bookmarks"]:
-                        if bookmark["url"] == action.url and bookmark["title"] == action.title:
-                            bookmark["folder"] = "No Folder"
-                            break
-                            
-                    with open("browser_bookmarks.json", "w") as f:
-                        json.dump(bookmarks, f)
-                        
-                    # Update the bookmark bar
-                    if self.parent() and hasattr(self.parent().parent(), 'update_bookmark_bar'):
-                        self.parent().parent().update_bookmark_bar()
-                        
-                except Exception as e:
-                    print(f"Error moving bookmark: {e}")
-        else:
-            super().mousePressEvent(e)
+            # A drag starts once the pointer moves; a plain click still opens it
+            self.drag_action = action
+            self.drag_start_position = e.pos()
+        super().mousePressEvent(e)
 
     def mouseMoveEvent(self, e):
-        if not hasattr(self, 'drag_action') or not self.drag_action:
+        if not self.drag_action:
             return super().mouseMoveEvent(e)
         
         if not e.buttons() & Qt.LeftButton:
@@ -212,35 +275,9 @@ class FolderMenu(QMenu):
             return
 
         drag = QDrag(self)
-        mime = QMimeData()
-        mime.setText(self.drag_action.url)
-        mime.setProperty('title', self.drag_action.title)
-        drag.setMimeData(mime)
-
-        action = self.drag_action  # Store reference before exec
-        result = drag.exec_(Qt.MoveAction)
-        
-        if result == Qt.MoveAction:
-            try:
-                with open("browser_bookmarks.json", "r") as f:
-                    bookmarks = json.load(f)
-                
-                # Find and update the bookmark's folder
-                for bookmark in bookmarks["bookmarks"]:
-                    if (bookmark["url"] == action.url and 
-                        bookmark["title"] == action.title):
-                        bookmark["folder"] = "No Folder"
-                        break
-                        
-                with open("browser_bookmarks.json", "w") as f:
-                    json.dump(bookmarks, f)
-                    
-                # Update the bookmark bar
-                if self.parent() and hasattr(self.parent().parent(), 'update_bookmark_bar'):
-                    self.parent().parent().update_bookmark_bar()
-                    
-            except Exception as e:
-                print(f"Error moving bookmark: {e}")
+        drag.setMimeData(bookmark_mime_data(self.drag_action.bookmark_id, self.drag_action.url))
+        # The drop target moves the bookmark in the database
+        drag.exec_(Qt.MoveAction)
 
         # Clear drag data
         self.drag_start_position = None
@@ -253,47 +290,194 @@ class FolderMenu(QMenu):
         super().mouseReleaseEvent(e)
 
     def dragEnterEvent(self, e):
-        if e.mimeData().hasText():
+        if self.bar is not None and dropped_bookmark_id(e.mimeData()) is not None:
             e.acceptProposedAction()
 
+    def dragMoveEvent(self, e):
+        e.acceptProposedAction()
+
     def dropEvent(self, e):
+        bookmark_id = dropped_bookmark_id(e.mimeData())
+        if bookmark_id is None:
+            return
+        # Dropped onto an entry: insert in front of it, otherwise at the end
+        target = self.actionAt(e.pos())
+        before_id = target.bookmark_id if isinstance(target, DraggableAction) else None
+        self.bar.browser.db.move_bookmark_async(bookmark_id, self.folder_id, before_id)
+        self.bar.browser.update_bookmark_bar()
         e.acceptProposedAction()
 
 class BookmarkBar(QToolBar):
+    """Bookmark toolbar that only builds what is on screen
+
+    Folders and bookmarks are kept as id-keyed rows. Buttons exist only for
+    the items that fit the bar's width and are diffed by id on every sync;
+    the rest are listed in an overflow menu. Every menu creates its actions
+    when it is about to open, so building the bar costs what is visible
+    rather than the size of the whole collection.
+    """
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setAcceptDrops(True)
         self.setMovable(False)
+        self.browser = parent
+        # ("folder" | "bookmark", id) -> row, and the bar's items in order
+        self.rows = {}
+        self.items = []
+        # Folder id -> its bookmark rows; a list is only replaced when the
+        # folder's contents change, so menus can tell they are current
+        self.folder_bookmarks = {}
+        # Key -> [widget, toolbar action] for the items on the bar
+        self.widgets = {}
+
+        self.overflow_items = []
+        self.overflow_shown = None
+        self.overflow_menus = []
+        self.overflow_button = QToolButton(self)
+        self.overflow_button.setText("»")
+        self.overflow_button.setPopupMode(QToolButton.InstantPopup)
+        self.overflow_button.setMenu(QMenu(self.overflow_button))
+        self.overflow_button.menu().aboutToShow.connect(self.populate_overflow)
+        self.overflow_action = self.addWidget(self.overflow_button)
+        self.overflow_action.setVisible(False)
+
+    def sync(self, folders, bookmarks):
+        rows = {}
+        folder_bookmarks = {}
+        for folder in folders:
+            rows[("folder", folder["id"])] = folder
+            folder_bookmarks[folder["id"]] = []
+        bar_items = [("folder", folder["id"]) for folder in folders]
+        for bookmark in bookmarks:
+            rows[("bookmark", bookmark["id"])] = bookmark
+            if bookmark["folder_id"] in folder_bookmarks:
+                folder_bookmarks[bookmark["folder_id"]].append(bookmark)
+            else:
+                bar_items.append(("bookmark", bookmark["id"]))
+        for folder_id, contents in folder_bookmarks.items():
+            if self.folder_bookmarks.get(folder_id) == contents:
+                folder_bookmarks[folder_id] = self.folder_bookmarks[folder_id]
+
+        # Buttons for rows that are gone or changed are recreated if needed
+        for key in list(self.widgets):
+            if rows.get(key) != self.rows.get(key):
+                self.remove_widget(key)
+        self.rows = rows
+        self.items = bar_items
+        self.folder_bookmarks = folder_bookmarks
+        self.layout_items()
+
+    def layout_items(self):
+        """Put as many items on the bar as fit its width; the rest overflow"""
+        spacing = self.layout().spacing()
+        available = self.contentsRect().width() - self.overflow_button.sizeHint().width() - spacing
+        used = 0
+        visible = 0
+        for key in self.items:
+            entry = self.widgets.get(key)
+            widget = entry[0] if entry else self.create_widget(key)
+            used += widget.sizeHint().width() + spacing
+            if used > available:
+                if not entry:
+                    widget.deleteLater()
+                break
+            if not entry:
+                self.widgets[key] = [widget, None]
+            visible += 1
+
+        shown = set(self.items[:visible])
+        for key in list(self.widgets):
+            if key not in shown:
+                self.remove_widget(key)
+        # Walk backwards so each new or moved button goes in front of its
+        # successor; buttons already in place are left alone
+        actions = self.actions()
+        following = self.overflow_action
+        for key in reversed(self.items[:visible]):
+            entry = self.widgets[key]
+            if entry[1] is not None:
+                position = actions.index(entry[1])
+                if actions[position + 1] is not following:
+                    # A toolbar cannot re-insert a removed widget, so a
+                    # moved item gets a new button
+                    self.remove_widget(key)
+                    entry = self.widgets[key] = [self.create_widget(key), None]
+            if entry[1] is None:
+                entry[1] = self.insertWidget(following, entry[0])
+                actions = self.actions()
+            following = entry[1]
+
+        self.overflow_items = self.items[visible:]
+        self.overflow_action.setVisible(bool(self.overflow_items))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.layout_items()
+
+    def create_widget(self, key):
+        row = self.rows[key]
+        if key[0] == "folder":
+            button = FolderButton(row["name"], self.browser, row["id"])
+            button.setMenu(FolderMenu(button, self, row["id"]))
+            button.customContextMenuRequested.connect(
+                lambda pos, folder_id=row["id"]: self.browser.show_folder_context_menu(pos, folder_id)
+            )
+            return button
+        button = BookmarkButton(row["title"], row["url"], self.browser, row["id"], row["folder_id"])
+        button.clicked.connect(
+            lambda checked=False, url=row["url"]: self.browser.browser.setUrl(QUrl(url))
+        )
+        return button
+
+    def create_action(self, bookmark, menu):
+        action = DraggableAction(bookmark["title"], bookmark["url"], menu, bookmark["id"])
+        action.triggered.connect(
+            lambda checked=False, url=bookmark["url"]: self.browser.browser.setUrl(QUrl(url))
+        )
+        return action
+
+    def remove_widget(self, key):
+        widget, action = self.widgets.pop(key)
+        if action is not None:
+            self.removeAction(action)
+        widget.deleteLater()
+
+    def populate_overflow(self):
+        items = self.overflow_items
+        if items is self.overflow_shown:
+            return
+        menu = self.overflow_button.menu()
+        menu.clear()
+        for submenu in self.overflow_menus:
+            submenu.deleteLater()
+        self.overflow_menus = []
+        for key in items:
+            row = self.rows[key]
+            if key[0] == "folder":
+                submenu = FolderMenu(menu, self, row["id"])
+                submenu.setTitle(row["name"])
+                menu.addMenu(submenu)
+                self.overflow_menus.append(submenu)
+            else:
+                menu.addAction(self.create_action(row, menu))
+        self.overflow_shown = items
 
     def dragEnterEvent(self, event: QDragEnterEvent):
-        if event.mimeData().hasText():
+        if dropped_bookmark_id(event.mimeData()) is not None:
             event.acceptProposedAction()
 
     def dropEvent(self, event: QDropEvent):
-        url = event.mimeData().text()
-        title = event.mimeData().property('title')
-        if not title:  # Fallback if title not in mime data
-            title = url
-        
-        try:
-            with open("browser_bookmarks.json", "r") as f:
-                bookmarks = json.load(f)
-            
-            # Find and update the bookmark's folder
-            for bookmark in bookmarks["bookmarks"]:
-                if bookmark["url"] == url:
-                    bookmark["folder"] = "No Folder"
-                    break
-                    
-            with open("browser_bookmarks.json", "w") as f:
-                json.dump(bookmarks, f)
-                
-            # Update the bookmark bar
-            if self.parent():
-                self.parent().update_bookmark_bar()
-                
-        except Exception as e:
-            print(f"Error moving bookmark: {e}")
+        bookmark_id = dropped_bookmark_id(event.mimeData())
+        if bookmark_id is None:
+            return
+        # Dropped onto a bookmark: insert in front of it, otherwise at the end
+        target = self.childAt(event.pos())
+        while target is not None and not isinstance(target, BookmarkButton):
+            target = target.parentWidget() if target is not self else None
+        before_id = target.bookmark_id if target is not None else None
+        self.browser.db.move_bookmark_async(bookmark_id, None, before_id)
+        self.browser.update_bookmark_bar()
+        event.acceptProposedAction()
 
 class Browser(QMainWindow):
     def __init__(self):
@@ -303,8 +487,11 @@ class Browser(QMainWindow):
         self.setWindowTitle("Secure Browser")
         self.setGeometry(300, 300, 1024, 768)
         
-        # Load settings first - this will set self.settings
-        self.load_and_apply_settings()
+        # Load settings once; later changes re-apply only what they affect
+        self.settings = SettingsStore(self.db, self)
+        self.settings.load()
+        apply_theme(self, self.settings.get("theme"))
+        self.settings.watch("theme", lambda theme: apply_theme(self, theme))
         
         # Rest of the initialization using self.settings
         # Configure profile for cookie management
@@ -319,18 +506,32 @@ class Browser(QMainWindow):
         self.profile.setCachePath(self.cookie_path)
         
         # Apply cookie settings from loaded settings
-        if self.settings.get("enable_cookies", False):
-            self.profile.setPersistentCookiesPolicy(QWebEngineProfile.AllowPersistentCookies)
-        else:
-            self.profile.setPersistentCookiesPolicy(QWebEngineProfile.NoPersistentCookies)
+        self.apply_cookie_policy(self.settings.get("enable_cookies"))
+        self.settings.watch("enable_cookies", self.apply_cookie_policy)
         
         # Set up ad blocker
-        self.ad_blocker = AdBlocker()
+        db_dir = os.path.dirname(os.path.abspath(self.db.db_path))
+        self.ad_blocker = AdBlocker(os.path.join(db_dir, ADBLOCK_CACHE_FILE))
         self.profile.setUrlRequestInterceptor(self.ad_blocker)
         
         # Initialize secure DNS resolver
         self.dns_resolver = SecureDNSResolver()
         self.dns_resolver.resolution_complete.connect(self.on_dns_resolved)
+        # The web engine connects through a local proxy that resolves hosts
+        # with the secure resolver, so the system resolver is never asked
+        self.dns_proxy = DNSProxy(self.dns_resolver)
+        self.dns_proxy.start()
+        # The proxy only serves clients that know this launch's credential
+        QNetworkProxy.setApplicationProxy(
+            QNetworkProxy(QNetworkProxy.HttpProxy, "127.0.0.1", self.dns_proxy.port,
+                          self.dns_proxy.username, self.dns_proxy.password))
+        # Start warm with the answers saved by the last run, then prefetch
+        # the most visited sites that are still missing
+        self.db.load_dns_cache_async(time.time() - self.dns_resolver.cache.max_stale,
+                                     callback=self.dns_resolver.cache.load)
+        self.dns_prefetcher = DNSPrefetcher(self.dns_resolver, self)
+        self.db.get_most_visited_urls_async(PREFETCH_TOP_URLS,
+                                            callback=self.dns_prefetcher.prefetch_urls)
         
         # Configure profile for DNS security
         self.profile.setUrlRequestInterceptor(self.ad_blocker)
@@ -338,18 +539,19 @@ class Browser(QMainWindow):
         # Create web view with settings
         self.browser = QWebEngineView()
         self.page = QWebEnginePage(self.profile, self.browser)
+        self.page.proxyAuthenticationRequired.connect(self.on_proxy_authentication)
         self.browser.setPage(self.page)
         
         # Configure browser settings from loaded settings
         browser_settings = self.browser.settings()
-        browser_settings.setAttribute(QWebEngineSettings.JavascriptEnabled, 
-                                   self.settings.get("enable_javascript", False))
+        self.apply_javascript(self.settings.get("enable_javascript"))
+        self.settings.watch("enable_javascript", self.apply_javascript)
         browser_settings.setAttribute(QWebEngineSettings.PluginsEnabled, False)
         browser_settings.setAttribute(QWebEngineSettings.FullScreenSupportEnabled, True)
         browser_settings.setAttribute(QWebEngineSettings.WebGLEnabled, False)
         
         # Set homepage from settings
-        self.browser.setUrl(QUrl(self.settings.get("homepage", "https://www.duckduckgo.com")))
+        self.open_url(self.settings.get("homepage", "https://www.duckduckgo.com"))
         
         # Connect signals for cookie management - modify these connections
         self.browser.loadFinished.connect(self.on_load_finished)
@@ -372,9 +574,14 @@ class Browser(QMainWindow):
         self.reload_button = QPushButton("↻")
         self.reload_button.clicked.connect(self.browser.reload)
         
-        # URL bar
+        # URL bar, with suggestions from history, bookmarks and past searches
         self.url_bar = QLineEdit()
         self.url_bar.returnPressed.connect(self.navigate_to_url)
+        self.omnibox = OmniboxCompleter(self.db, self.url_bar)
+        # Enter on a highlighted suggestion already reaches returnPressed
+        self.omnibox.popup().clicked.connect(
+            lambda index: self.navigate_to_url(index.data(Qt.UserRole)))
+        self.omnibox.reload()
         
         # Control buttons
         self.go_button = QPushButton("Go")
@@ -430,6 +637,12 @@ class Browser(QMainWindow):
         add_bookmark_action.triggered.connect(self.add_current_to_bookmarks)
         settings_menu.addAction(add_bookmark_action)
         
+        self.allow_cookies_action = QAction("Allow All Cookies on This Site", self)
+        self.allow_cookies_action.setCheckable(True)
+        self.allow_cookies_action.triggered.connect(self.toggle_site_cookies)
+        settings_menu.aboutToShow.connect(self.update_allow_cookies_action)
+        settings_menu.addAction(self.allow_cookies_action)
+        
         settings_menu.addSeparator()
         
         about_action = QAction("About", self)
@@ -474,22 +687,17 @@ class Browser(QMainWindow):
         self.status_label = QLabel("Ready")  # Changed from status_message to status_label
         self.status_bar.addWidget(self.status_label)
         
-        # Track cookies with a list
-        self.cookies = []
+        # Index of the cookies kept in the store
+        self.cookies = CookieIndex()
         self.cookie_count = 0
         cookie_store = self.profile.cookieStore()
+        # Third-party and tracker cookies are refused before they are stored
+        self.cookie_filter = CookieFilter()
+        cookie_store.setCookieFilter(self.cookie_filter)
+        self.db.get_cookie_allowlist_async(callback=self.cookie_filter.set_allowed_sites)
         cookie_store.cookieAdded.connect(self.on_cookie_added)
         cookie_store.cookieRemoved.connect(self.on_cookie_removed)
         
-        # Add tracking domains list
-        self.tracking_domains = [
-            'analytics', 'tracker', 'metrics',
-            'doubleclick.net', 'facebook.com',
-            'google-analytics.com', 'advertising',
-            'pixel', 'statistics', 'stats',
-            'tracking', 'adserver', 'monitor'
-        ]
-        
         # Add search engine URLs
         self.search_engines = {
             "google": "https://www.google.com/search?q={}",
@@ -507,26 +715,39 @@ class Browser(QMainWindow):
             "bing": "https://www.bing.com/search?q={}"
         }
 
-    def load_and_apply_settings(self):
-        self.settings = self.db.load_settings()
-        if not self.settings:
-            self.settings = {
-                "homepage": "https://www.duckduckgo.com",
-                "search_engine": "duckduckgo",
-                "enable_cookies": False,
-                "enable_javascript": False,
-                "theme": "dracula",
-                "download_path": os.path.expanduser("~/Downloads")
-            }
-            self.db.save_settings(self.settings)
-        apply_theme(self, self.settings.get("theme", "dracula"))
+        # Write buffered history visits in batches
+        self.history_flush_timer = QTimer(self)
+        self.history_flush_timer.timeout.connect(self.db.flush_history_async)
+        self.history_flush_timer.start(2000)
+
+        # Checkpoint the database WAL while the browser is idle
+        self.db_maintenance_timer = QTimer(self)
+        self.db_maintenance_timer.timeout.connect(self.db.checkpoint_if_idle_async)
+        self.db_maintenance_timer.start(10000)
+
+        # Save the DNS cache now and then, so a crash loses little of it
+        self.dns_save_timer = QTimer(self)
+        self.dns_save_timer.timeout.connect(self.save_dns_cache)
+        self.dns_save_timer.start(DNS_CACHE_SAVE_INTERVAL)
+        QApplication.instance().aboutToQuit.connect(self.shutdown)
+
+        # Move history from older versions into the database in the background
+        self.db.migrate_history_async(progress=self.on_history_migration_progress,
+                                      done=self.on_history_migrated)
+
+    def apply_cookie_policy(self, enabled):
+        if enabled:
+            self.profile.setPersistentCookiesPolicy(QWebEngineProfile.AllowPersistentCookies)
+        else:
+            self.profile.setPersistentCookiesPolicy(QWebEngineProfile.NoPersistentCookies)
+
+    def apply_javascript(self, enabled):
+        self.browser.settings().setAttribute(QWebEngineSettings.JavascriptEnabled, enabled)
 
     def open_settings(self):
+        # The dialog updates self.settings, whose watchers apply the changes
         settings_dialog = Settings(self)
-        result = settings_dialog.exec_()
-        if result == QDialog.Accepted:
-            # Reload settings and apply them
-            self.load_and_apply_settings()
+        settings_dialog.exec_()
 
     def clear_cookies(self, _):
         """Clear all cookies and reset counter"""
@@ -538,12 +759,33 @@ class Browser(QMainWindow):
     def on_load_finished(self, ok):
         if ok:
             self.set_status("Page loaded")  # Updated method name
-            # Don't clear all cookies, they're managed by on_cookie_added
+            # Resolve the hosts this page links to before they are clicked
+            self.page.runJavaScript(LINK_HOSTS_SCRIPT, QWebEngineScript.ApplicationWorld,
+                                    self.prefetch_page_links)
+            self.update_cookie_display()
         else:
             self.set_status("Failed to load page")  # Updated method name
             
-    def navigate_to_url(self):
-        url = self.url_bar.text().strip()
+    def prefetch_page_links(self, hosts):
+        if isinstance(hosts, list):
+            self.dns_prefetcher.prefetch(host for host in hosts if isinstance(host, str))
+
+    def on_proxy_authentication(self, url, authenticator, proxy_host):
+        """Answer the local DNS proxy's challenge with its credential"""
+        if proxy_host == "127.0.0.1":
+            authenticator.setUser(self.dns_proxy.username)
+            authenticator.setPassword(self.dns_proxy.password)
+
+    def open_url(self, url):
+        """Load url, resolving its host over DoH while the load starts"""
+        qurl = QUrl(url)
+        if qurl.host():
+            # The proxy's lookup for the same host joins this one
+            self.dns_resolver.resolve_async(qurl.host())
+        self.browser.setUrl(qurl)
+
+    def navigate_to_url(self, text=None):
+        url = (text if isinstance(text, str) else self.url_bar.text()).strip()
         
         # Check if it's a valid URL
         if any([
@@ -559,14 +801,17 @@ class Browser(QMainWindow):
             elif not url.startswith('https://'):
                 url = 'https://' + url
                 
-            self.browser.setUrl(QUrl(url))
+            self.open_url(url)
             self.set_status(f"Loading: {url}")
         else:
             # Use search engine with HTTPS
             engine = self.settings.get("search_engine", "duckduckgo").lower()
             search_url = self.search_engines.get(engine, self.search_engines["duckduckgo"])
             search_url = search_url.format(url.replace(' ', '+'))
-            self.browser.setUrl(QUrl(search_url))
+            self.open_url(search_url)
+            if url:
+                self.omnibox.record_search(url)
+                self.db.record_search_query_async(url)
 
     def update_url(self, qurl):
         url = qurl.toString()
@@ -580,6 +825,8 @@ class Browser(QMainWindow):
     # Add a method to intercept URL changes
     def urlChanged(self, qurl):
         url = qurl.toString()
+        if qurl.host():
+            self.dns_prefetcher.record_navigation(qurl.host())
         if url.startswith('http://'):
             https_url = 'https://' + url[7:]
             self.browser.setUrl(QUrl(https_url))
@@ -590,7 +837,8 @@ class Browser(QMainWindow):
         
     def update_history(self, title):
         url = self.browser.url().toString()
-        self.db.add_history_entry(title, url)
+        self.db.queue_history_entry_async(title, url)
+        self.omnibox.record_visit(url, title)
 
     def handle_download(self, download):
         path = os.path.join(
@@ -616,87 +864,85 @@ class Browser(QMainWindow):
         self.downloads_dialog.exec_()
         
     def on_cookie_added(self, cookie):
-        cookie_domain = cookie.domain()
-        if cookie_domain.startswith('.'):
-            cookie_domain = cookie_domain[1:]
-
-        current_domain = self.browser.url().host()
-        
-        # Check if it's a third-party or tracking cookie
-        is_third_party = current_domain not in cookie_domain
-        is_tracker = any(tracker in cookie_domain.lower() for tracker in self.tracking_domains)
-        
-        if is_third_party or is_tracker:
-            # Remove tracking/third-party cookie
-            self.profile.cookieStore().deleteCookie(cookie)
-        else:
+        # The filter has already refused unwanted cookies; those left in the
+        # persistent store from before it are refused whenever a page uses them
+        if self.cookies.add(cookie):
             # Keep first-party cookie
-            self.cookies.append(cookie)
-            self.cookie_count += 1
+            self.cookie_count = len(self.cookies)
             self.update_cookie_display()
 
     def on_cookie_removed(self, cookie):
-        if cookie in self.cookies:
-            self.cookies.remove(cookie)
+        if self.cookies.remove(cookie):
             self.cookie_count = len(self.cookies)
             self.update_cookie_display()
 
     def update_cookie_display(self):
         self.cookie_label.setText(f"Cookies: {self.cookie_count}")
+        host = self.browser.url().host()
+        if host:
+            accepted, rejected = self.cookie_filter.site_counts(host)
+            self.cookie_label.setToolTip(f"On this site: {accepted} accepted, {rejected} blocked")
+
+    def update_allow_cookies_action(self):
+        host = self.browser.url().host()
+        self.allow_cookies_action.setEnabled(bool(host))
+        self.allow_cookies_action.setChecked(bool(host) and self.cookie_filter.is_allowed_site(host))
+
+    def toggle_site_cookies(self, allowed):
+        """Add the current site to the cookie allowlist, or remove it"""
+        host = self.browser.url().host()
+        if not host:
+            return
+        site = registrable_domain(host)
+        sites = set(self.cookie_filter.allowed_sites)
+        if allowed:
+            sites.add(site)
+            self.db.allow_cookies_for_site_async(site)
+            self.set_status(f"All cookies allowed on {site}")
+        else:
+            sites.discard(site)
+            self.db.disallow_cookies_for_site_async(site)
+            self.set_status(f"Third-party and tracking cookies blocked on {site}")
+        self.cookie_filter.set_allowed_sites(sites)
         
     def set_status(self, message):  # New method name to avoid confusion
         """Update the status bar message."""
         if hasattr(self, 'status_label'):
             self.status_label.setText(message)
             
-    def update_bookmark_bar(self):
-        self.bookmark_bar.clear()
-        
-        # Get folders and bookmarks from database
-        folders = self.db.get_folders()
-        bookmarks = self.db.get_bookmarks()
-        
-        # Create folder menus
-        folder_menus = {}
-        for folder in folders:
-            folder_name = folder["name"]
-            folder_button = FolderButton(folder_name, self)  # Pass self instead of bookmark_bar
-            folder_menu = FolderMenu(folder_button)
-            folder_button.setMenu(folder_menu)
-            folder_button.customContextMenuRequested.connect(
-                lambda pos, name=folder_name: self.show_folder_context_menu(pos, name)
-            )
-            self.bookmark_bar.addWidget(folder_button)
-            folder_menus[folder_name] = folder_menu
+    def on_history_migration_progress(self, count):
+        self.set_status(f"Importing history from an older version: {count} entries")
 
-        # Add bookmarks
-        for bookmark in bookmarks:
-            folder = bookmark.get("folder", "No Folder")
-            if folder != "No Folder" and folder in folder_menus:
-                action = DraggableAction(bookmark["title"], bookmark["url"], folder_menus[folder])
-                folder_menus[folder].addAction(action)
-                action.triggered.connect(
-                    lambda checked=False, url=bookmark["url"]: self.browser.setUrl(QUrl(url))
-                )
-            else:
-                if folder == "No Folder":
-                    button = BookmarkButton(bookmark["title"], bookmark["url"], self)  # Pass self instead of bookmark_bar
-                    button.clicked.connect(
-                        lambda checked=False, url=bookmark["url"]: self.browser.setUrl(QUrl(url))
-                    )
-                    self.bookmark_bar.addWidget(button)
-
-    def show_folder_context_menu(self, pos, folder_name):
+    def on_history_migrated(self, count):
+        self.set_status(f"Imported {count} history entries")
+        # Suggest the imported pages in the address bar
+        self.omnibox.reload()
+
+    def update_bookmark_bar(self):
+        # Fetch folders and bookmarks off the GUI thread
+        self.db.get_bookmark_bar_async(callback=self.populate_bookmark_bar)
+
+    def populate_bookmark_bar(self, result):
+        folders, bookmarks = result
+        self.omnibox.set_bookmarks([(bookmark["title"], bookmark["url"]) for bookmark in bookmarks])
+        # Hosts already cached are skipped, so repeated updates cost little
+        self.dns_prefetcher.prefetch_urls(
+            bookmark["url"] for bookmark in bookmarks if bookmark["folder_id"] is None)
+        # Only the widgets for what changed since the last update are touched
+        self.bookmark_bar.sync(folders, bookmarks)
+
+    def show_folder_context_menu(self, pos, folder_id):
         """Show context menu for folder"""
         menu = QMenu(self)
         delete_action = menu.addAction("Delete Folder")
         action = menu.exec_(self.bookmark_bar.mapToGlobal(pos))
         
         if action == delete_action:
-            self.delete_folder(folder_name)
+            self.delete_folder(folder_id)
 
-    def delete_folder(self, folder_name):
-        self.db.delete_bookmark_folder(folder_name)
+    def delete_folder(self, folder_id):
+        # Its bookmarks move back onto the bar
+        self.db.delete_bookmark_folder_async(folder_id)
         self.update_bookmark_bar()
 
     def show_bookmark_bar_context_menu(self, pos):
@@ -716,7 +962,7 @@ class Browser(QMainWindow):
     def add_bookmark_folder(self):
         folder_name, ok = QInputDialog.getText(self, "New Folder", "Folder name:")
         if ok and folder_name:
-            self.db.add_bookmark_folder(folder_name)
+            self.db.add_bookmark_folder_async(folder_name)
             self.update_bookmark_bar()
 
     def toggle_bookmark_bar(self):
@@ -733,12 +979,25 @@ class Browser(QMainWindow):
     def add_current_to_bookmarks(self):
         title = self.browser.page().title()
         url = self.browser.url().toString()
-        self.db.add_bookmark(title, url)
+        self.db.add_bookmark_async(title, url)
         self.update_bookmark_bar()
         
     def on_dns_resolved(self, hostname, ip):
         """Handle secure DNS resolution result"""
-        self.set_status(f"Secure DNS resolution: {hostname} -> {ip}")
+        # Prefetched hosts resolve all the time; only report the page's own
+        if hostname == self.browser.url().host():
+            self.set_status(f"Secure DNS resolution: {hostname} -> {ip}")
+
+    def save_dns_cache(self):
+        self.db.save_dns_cache_async(self.dns_resolver.cache.snapshot())
+
+    def shutdown(self):
+        """Flush and close everything that holds on-disk state"""
+        self.settings.flush()
+        self.dns_proxy.shutdown()
+        self.dns_resolver.shutdown()
+        self.save_dns_cache()
+        self.db.close()
                 
 if __name__ == "__main__":    
     app = QApplication(sys.argv)    
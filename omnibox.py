@@ -0,0 +1,317 @@
+import bisect
+import heapq
+import math
+import threading
+import time
+from PyQt5.QtWidgets import QCompleter
+from PyQt5.QtGui import QStandardItemModel, QStandardItem
+from PyQt5.QtCore import Qt, QModelIndex, pyqtSignal
+
+# Frecency: every visit adds a weight that halves every FRECENCY_HALF_LIFE
+# seconds. Scores are kept as log(sum of weights) measured against a fixed
+# clock, so decay never has to be applied to stored entries and an entry's
+# score only changes when it is visited.
+FRECENCY_HALF_LIFE = 30 * 24 * 3600
+DECAY_RATE = math.log(2) / FRECENCY_HALF_LIFE
+# Weight of a bookmark relative to a single visit at the time it was loaded
+BOOKMARK_WEIGHT = 10.0
+# A typed search query counts less than a visited page
+SEARCH_WEIGHT = 0.5
+# Suggestions shown under the address bar
+SUGGESTION_LIMIT = 8
+# History URLs loaded at startup, most recently visited first
+MAX_HISTORY_ENTRIES = 200000
+# Measured cost of one step of the frecency walk relative to scanning one
+# score of a prefix range; decides which of the two suggest() uses
+WALK_COST_RATIO = 3
+
+URL_PREFIXES = ("https://", "http://")
+
+KIND_URL = "url"
+KIND_SEARCH = "search"
+
+def normalize(text):
+    """Index key for a URL or typed text: lowercase, no scheme or www."""
+    key = text.strip().lower()
+    for prefix in URL_PREFIXES:
+        if key.startswith(prefix):
+            key = key[len(prefix):]
+            break
+    if key.startswith("www."):
+        key = key[4:]
+    return key
+
+def log_weight(weight, timestamp):
+    """A weight given at timestamp, in the log-space frecency scale"""
+    return math.log(weight) + DECAY_RATE * timestamp
+
+def log_add(a, b):
+    """log(exp(a) + exp(b)) without overflowing"""
+    if a < b:
+        a, b = b, a
+    if b == -math.inf:
+        return a
+    return a + math.log1p(math.exp(b - a))
+
+class Suggestion:
+    __slots__ = ("key", "text", "title", "kind", "visits", "bonus", "score")
+
+    def __init__(self, key, text, title, kind):
+        self.key = key
+        self.text = text
+        self.title = title
+        self.kind = kind
+        # Log-space visit weight and bookmark bonus; score combines both and
+        # stays None until the entry is ranked
+        self.visits = -math.inf
+        self.bonus = -math.inf
+        self.score = None
+
+class OmniboxIndex:
+    """In-memory prefix index of history URLs, bookmarks and past searches
+
+    Keys live in a sorted list, so a typed prefix is a contiguous range found
+    with two bisects. Picking the best few entries of that range scans it
+    when it is small; for short prefixes that match a large share of the
+    index it instead walks all entries in frecency order until enough of
+    them match. The cheaper walk is chosen per query, which keeps either
+    path to a few thousand steps (about 1-2 ms) on a million entries.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        # Sorted (key, kind) pairs for the prefix ranges, with their scores
+        # in a parallel list so a range is scanned without touching entries
+        self.keys = []
+        self.scores = []
+        # Sorted (-score, key, kind) for the frecency walk
+        self.ranked = []
+        self.bookmarked = set()
+        self.last_visit_url = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def entry(self, text, title, kind):
+        key = normalize(text)
+        entry = self.entries.get((key, kind))
+        if entry is None:
+            entry = Suggestion(key, text, title, kind)
+            self.entries[(key, kind)] = entry
+            position = bisect.bisect_left(self.keys, (key, kind))
+            self.keys.insert(position, (key, kind))
+            self.scores.insert(position, -math.inf)
+        return entry
+
+    def remove(self, entry):
+        del self.entries[(entry.key, entry.kind)]
+        position = bisect.bisect_left(self.keys, (entry.key, entry.kind))
+        del self.keys[position]
+        del self.scores[position]
+        if entry.score is not None:
+            del self.ranked[bisect.bisect_left(self.ranked, (-entry.score, entry.key, entry.kind))]
+
+    def rescore(self, entry):
+        score = log_add(entry.visits, entry.bonus)
+        if entry.score is not None:
+            position = bisect.bisect_left(self.ranked, (-entry.score, entry.key, entry.kind))
+            del self.ranked[position]
+        entry.score = score
+        bisect.insort(self.ranked, (-score, entry.key, entry.kind))
+        self.scores[bisect.bisect_left(self.keys, (entry.key, entry.kind))] = score
+
+    def load(self, urls, bookmarks, searches, now=None):
+        """Build the index from (url, title, visit_count, last_visit) history
+        rows, (title, url) bookmarks and (query, use_count, last_used) searches
+
+        Visits before the index existed are approximated as all happening at
+        the last visit, which is what a single score per URL allows.
+        """
+        now = time.time() if now is None else now
+        entries = {}
+        for url, title, visit_count, last_visit in urls:
+            entry = Suggestion(normalize(url), url, title or "", KIND_URL)
+            entry.visits = log_weight(max(visit_count, 1), last_visit)
+            entries[(entry.key, KIND_URL)] = entry
+        for title, url in bookmarks:
+            key = (normalize(url), KIND_URL)
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[key] = Suggestion(key[0], url, title or "", KIND_URL)
+            entry.bonus = log_weight(BOOKMARK_WEIGHT, now)
+            entry.title = entry.title or title or ""
+        for query, use_count, last_used in searches:
+            entry = Suggestion(normalize(query), query, "", KIND_SEARCH)
+            entry.visits = log_weight(SEARCH_WEIGHT * max(use_count, 1), last_used)
+            entries[(entry.key, KIND_SEARCH)] = entry
+        for entry in entries.values():
+            entry.score = log_add(entry.visits, entry.bonus)
+
+        self.entries = entries
+        self.keys = sorted(entries)
+        self.scores = [entries[key].score for key in self.keys]
+        self.ranked = sorted((-entry.score, entry.key, entry.kind) for entry in entries.values())
+        self.bookmarked = {key for key, entry in entries.items() if entry.bonus != -math.inf}
+
+    def record_visit(self, url, title, timestamp=None):
+        """Count a page visit; repeated calls for the same page only retitle it"""
+        if not url.startswith(URL_PREFIXES):
+            return
+        if url == self.last_visit_url:
+            entry = self.entries.get((normalize(url), KIND_URL))
+            if entry is not None:
+                entry.title = title
+                return
+        self.last_visit_url = url
+        entry = self.entry(url, title, KIND_URL)
+        entry.title = title
+        timestamp = time.time() if timestamp is None else timestamp
+        entry.visits = log_add(entry.visits, log_weight(1.0, timestamp))
+        self.rescore(entry)
+
+    def record_search(self, query, timestamp=None):
+        query = query.strip()
+        if not query:
+            return
+        entry = self.entry(query, "", KIND_SEARCH)
+        timestamp = time.time() if timestamp is None else timestamp
+        entry.visits = log_add(entry.visits, log_weight(SEARCH_WEIGHT, timestamp))
+        self.rescore(entry)
+
+    def set_bookmarks(self, bookmarks, now=None):
+        """Give exactly these (title, url) pairs the bookmark bonus"""
+        now = time.time() if now is None else now
+        keys = set()
+        for title, url in bookmarks:
+            entry = self.entry(url, title, KIND_URL)
+            entry.title = entry.title or title
+            keys.add((entry.key, KIND_URL))
+            if entry.bonus == -math.inf:
+                entry.bonus = log_weight(BOOKMARK_WEIGHT, now)
+                self.rescore(entry)
+        for key in self.bookmarked - keys:
+            entry = self.entries[key]
+            if entry.visits == -math.inf:
+                # Never visited: nothing left to suggest it for
+                self.remove(entry)
+                continue
+            entry.bonus = -math.inf
+            self.rescore(entry)
+        self.bookmarked = keys
+
+    def suggest(self, text, limit=SUGGESTION_LIMIT):
+        """Best entries whose key starts with the typed text, best first"""
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self.keys, (prefix,))
+        end = bisect.bisect_left(self.keys, (prefix + "\U0010ffff",), start)
+        matches = end - start
+        if not matches:
+            return []
+
+        # Walking the frecency order finds a match every len/matches steps
+        if matches * matches <= WALK_COST_RATIO * limit * len(self.ranked):
+            best = heapq.nlargest(limit, range(start, end), key=self.scores.__getitem__)
+            return [self.entries[self.keys[position]] for position in best]
+
+        found = []
+        for negative_score, key, kind in self.ranked:
+            if key.startswith(prefix):
+                found.append(self.entries[(key, kind)])
+                if len(found) == limit:
+                    break
+        return found
+
+class OmniboxCompleter(QCompleter):
+    """Address bar completer answering every keystroke from an OmniboxIndex
+
+    The index is built from the database on a background thread; visits and
+    searches recorded after its database read was queued are replayed onto
+    it when it is swapped in.
+    The completer is attached with setWidget() rather than
+    QLineEdit.setCompleter(), which would re-filter and preselect rows.
+    """
+    index_ready = pyqtSignal(object)
+
+    def __init__(self, db, line_edit):
+        super().__init__(line_edit)
+        self.db = db
+        self.index = OmniboxIndex()
+        self.pending = None
+        self.suggestions = QStandardItemModel(self)
+        self.setModel(self.suggestions)
+        # Rows are already ranked; the completer must not filter them again
+        self.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.setCompletionRole(Qt.UserRole)
+        self.setMaxVisibleItems(SUGGESTION_LIMIT)
+        self.index_ready.connect(self.swap_index)
+        self.setWidget(line_edit)
+        line_edit.textEdited.connect(self.update_suggestions)
+        self.highlighted[str].connect(line_edit.setText)
+
+    def reload(self):
+        """Rebuild the index from the database in the background"""
+        if self.pending is not None:
+            return
+        # The read is queued now, behind every visit already sent to the
+        # database, so exactly the ops recorded from here on are missing
+        # from it and get replayed
+        entries = self.db.submit(self.db.get_omnibox_entries, MAX_HISTORY_ENTRIES)
+        self.pending = []
+        threading.Thread(target=self.build_index, args=(entries,), daemon=True).start()
+
+    def build_index(self, entries):
+        try:
+            index = OmniboxIndex()
+            index.load(*entries.result())
+        except Exception as e:
+            print(f"Error building address bar index: {e}")
+            index = None
+        self.index_ready.emit(index)
+
+    def swap_index(self, index):
+        pending, self.pending = self.pending, None
+        if index is None:
+            return
+        for method, args in pending:
+            getattr(index, method)(*args)
+        # A cleared history no longer has the last page; its next title
+        # change then counts as a visit
+        if (normalize(self.index.last_visit_url or ""), KIND_URL) in index.entries:
+            index.last_visit_url = self.index.last_visit_url
+        self.index = index
+
+    def record(self, method, *args):
+        getattr(self.index, method)(*args)
+        if self.pending is not None:
+            self.pending.append((method, args))
+
+    def record_visit(self, url, title):
+        self.record("record_visit", url, title, time.time())
+
+    def record_search(self, query):
+        self.record("record_search", query, time.time())
+
+    def set_bookmarks(self, bookmarks):
+        self.record("set_bookmarks", bookmarks, time.time())
+
+    def update_suggestions(self, text):
+        """Refill the popup for the text typed so far"""
+        self.suggestions.clear()
+        for entry in self.index.suggest(text):
+            if entry.kind == KIND_SEARCH:
+                label = f"Search: {entry.text}"
+            elif entry.title:
+                label = f"{entry.text}  —  {entry.title}"
+            else:
+                label = entry.text
+            item = QStandardItem(label)
+            item.setData(entry.text, Qt.UserRole)
+            self.suggestions.appendRow(item)
+        if self.suggestions.rowCount():
+            self.complete()
+            # Nothing is highlighted until the user moves into the list
+            self.popup().setCurrentIndex(QModelIndex())
+        else:
+            self.popup().hide()
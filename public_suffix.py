@@ -0,0 +1,101 @@
+import functools
+import ipaddress
+import os
+
+# Mozilla's Public Suffix List (https://publicsuffix.org), shipped with the
+# browser; the system copy is used if the bundled file is missing
+PUBLIC_SUFFIX_LIST = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "public_suffix_list.dat")
+SYSTEM_PUBLIC_SUFFIX_LIST = "/usr/share/publicsuffix/public_suffix_list.dat"
+# Hosts whose registrable domain is remembered
+REGISTRABLE_DOMAIN_CACHE_SIZE = 8192
+
+class PublicSuffixList:
+    """Rules of the Public Suffix List, held as three sets of domains
+
+    Normal rules and exceptions ("!") are stored as written; a wildcard rule
+    "*.ck" is stored as its parent "ck". Internationalized rules are also
+    stored in their punycode form, which is how hosts arrive from URLs.
+    """
+
+    def __init__(self, lines=()):
+        self.rules = set()
+        self.wildcards = set()
+        self.exceptions = set()
+        for line in lines:
+            self.add_rule(line)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(f)
+
+    def add_rule(self, line):
+        # The rule is everything up to the first whitespace
+        rule = line.strip().split(None, 1)[0].lower() if line.strip() else ""
+        if not rule or rule.startswith("//"):
+            return
+        target = self.rules
+        if rule.startswith("!"):
+            target, rule = self.exceptions, rule[1:]
+        elif rule.startswith("*."):
+            target, rule = self.wildcards, rule[2:]
+        target.add(rule)
+        try:
+            ascii_rule = rule.encode("idna").decode("ascii")
+        except UnicodeError:
+            return
+        target.add(ascii_rule)
+
+    def public_suffix_length(self, labels):
+        """Number of trailing labels that form the public suffix"""
+        for start in range(len(labels)):
+            candidate = ".".join(labels[start:])
+            if candidate in self.exceptions:
+                # An exception is itself registrable; its parent is the suffix
+                return len(labels) - start - 1
+            if candidate in self.rules:
+                return len(labels) - start
+            if start + 1 < len(labels) and ".".join(labels[start + 1:]) in self.wildcards:
+                return len(labels) - start
+        # The default rule "*": the top-level label is a public suffix
+        return 1
+
+    def registrable_domain(self, host):
+        """The public suffix plus one label (eTLD+1), e.g. bbc.co.uk for
+        www.bbc.co.uk; IP addresses and bare public suffixes are returned whole"""
+        host = host.lower().strip(".")
+        if not host or ":" in host or is_ip_address(host):
+            return host
+        labels = host.split(".")
+        suffix_length = self.public_suffix_length(labels)
+        if suffix_length >= len(labels):
+            return host
+        return ".".join(labels[-suffix_length - 1:])
+
+def is_ip_address(host):
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+@functools.lru_cache(maxsize=1)
+def default_list():
+    """The bundled list, parsed on first use"""
+    for path in (PUBLIC_SUFFIX_LIST, SYSTEM_PUBLIC_SUFFIX_LIST):
+        if os.path.exists(path):
+            try:
+                return PublicSuffixList.from_file(path)
+            except OSError as e:
+                print(f"Error loading public suffix list: {e}")
+    print("Error loading public suffix list: not found, using top-level domains only")
+    return PublicSuffixList()
+
+@functools.lru_cache(maxsize=REGISTRABLE_DOMAIN_CACHE_SIZE)
+def registrable_domain(host):
+    return default_list().registrable_domain(host)
+
+def same_site(host, other_host):
+    """Whether two hosts share a registrable domain"""
+    return registrable_domain(host) == registrable_domain(other_host)
@@ -1,10 +1,93 @@
 from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, 
                            QLineEdit, QComboBox, QCheckBox, QPushButton,
                            QTabWidget, QWidget)
-import json
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
 import os
 from themes import THEMES, apply_theme
 
+# Settings used when the database has none; a stored value of a different
+# type than its default here is ignored
+DEFAULT_SETTINGS = {
+    "homepage": "https://www.duckduckgo.com",
+    "search_engine": "duckduckgo",
+    "enable_cookies": False,
+    "enable_javascript": False,
+    "theme": "dracula",
+    "download_path": os.path.expanduser("~/Downloads"),
+}
+# Milliseconds changed settings wait before they are written together
+SETTINGS_FLUSH_DELAY = 500
+
+class SettingsStore(QObject):
+    """Browser settings held in memory, loaded from the database once
+
+    Reads never touch the database. set() and update() only notify the
+    watchers of keys whose value actually changed, and changed keys are
+    written in one batch shortly afterwards (or by flush()).
+    """
+    changed = pyqtSignal(str, object)
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.values = dict(DEFAULT_SETTINGS)
+        self.dirty = set()
+        self.watchers = {}
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(SETTINGS_FLUSH_DELAY)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def load(self):
+        stored = self.db.load_settings() if self.db else {}
+        for key, value in stored.items():
+            default = DEFAULT_SETTINGS.get(key)
+            if default is None or type(value) is type(default):
+                self.values[key] = value
+        # Write defaults missing from the database, e.g. on first run
+        self.dirty.update(key for key in DEFAULT_SETTINGS if stored.get(key) != self.values[key])
+        if self.dirty:
+            self.flush_timer.start()
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def as_dict(self):
+        return dict(self.values)
+
+    def watch(self, key, callback):
+        """Call callback(value) whenever key changes"""
+        self.watchers.setdefault(key, []).append(callback)
+
+    def set(self, key, value):
+        default = DEFAULT_SETTINGS.get(key)
+        if default is not None and type(value) is not type(default):
+            raise TypeError(f"Setting {key} must be {type(default).__name__}, not {type(value).__name__}")
+        if key in self.values and self.values[key] == value:
+            return
+        self.values[key] = value
+        self.dirty.add(key)
+        self.flush_timer.start()
+        for callback in self.watchers.get(key, ()):
+            callback(value)
+        self.changed.emit(key, value)
+
+    def update(self, settings):
+        for key, value in settings.items():
+            self.set(key, value)
+
+    def flush(self):
+        """Write every changed setting in a single transaction"""
+        self.flush_timer.stop()
+        if not self.dirty or not self.db:
+            return
+        changes = {key: self.values[key] for key in self.dirty}
+        self.dirty = set()
+        self.db.save_settings_async(changes)
+
 class Settings(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -13,16 +96,6 @@ class Settings(QDialog):
         self.setWindowTitle("Browser Settings")
         self.setFixedSize(400, 500)
         
-        # Default settings
-        self.default_settings = {
-            "homepage": "https://www.duckduckgo.com",
-            "search_engine": "duckduckgo", 
-            "enable_cookies": True,
-            "enable_javascript": True,
-            "download_path": os.path.expanduser("~/Downloads"),
-            "theme": "dark"
-        }
-        
         self.current_settings = self.load_settings()
         self.create_settings_ui()
         
@@ -138,9 +211,13 @@ class Settings(QDialog):
         apply_theme(self, theme_name.lower())
 
     def load_settings(self):
-        if not self.db:
-            return self.default_settings.copy()
-        return self.db.load_settings() or self.default_settings.copy()
+        # The browser already holds the current settings; no need to query
+        if self.browser and getattr(self.browser, 'settings', None):
+            return self.browser.settings.as_dict()
+        settings = dict(DEFAULT_SETTINGS)
+        if self.db:
+            settings.update(self.db.load_settings())
+        return settings
 
     def save_settings(self):
         settings = {
@@ -152,11 +229,10 @@ class Settings(QDialog):
             "theme": self.theme_combo.currentText().lower()
         }
         
-        if self.db:
-            self.db.save_settings(settings)
-        
-        # Store settings in browser
-        if self.browser:
-            self.browser.settings = settings
+        # The browser's store applies and saves only what changed
+        if self.browser and getattr(self.browser, 'settings', None):
+            self.browser.settings.update(settings)
+        elif self.db:
+            self.db.save_settings_async(settings)
             
         self.accept()
\ No newline at end of file